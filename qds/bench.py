@@ -0,0 +1,326 @@
+# Copyright (c) 2009 Riccardo Lucchese, riccardo.lucchese at gmail.com
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+
+"""
+benchmarks of the integrators, Signal and the analysis helpers
+
+    python -m qds.bench [--quick] [--out results.json] [--compare baseline.json]
+
+every case runs in a forked process, reporting its best wall time over a few
+repetitions and the growth of the peak resident memory; results are written
+as a JSON list and can be compared against the results of another commit
+"""
+
+import sys
+import json
+import time
+import Queue
+import traceback
+import resource
+import subprocess
+import multiprocessing
+import numpy
+
+import lme
+import fme
+import util
+import bloch
+import matlab
+from signal import Signal
+
+
+def _quiet(info):
+    """
+    no-op integrate() callback, keeping the default progress print quiet
+    """
+    pass
+
+
+def _random_system(n, num_L, seed=0):
+    """
+    random Hamiltonian, Lindblad operators and initial state of order n
+    """
+    rng = numpy.random.RandomState(seed)
+    def random_matrix():
+        return rng.normal(size=(n, n)) + 1j*rng.normal(size=(n, n))
+    H = random_matrix()
+    H = 0.5*(H + H.conj().transpose())
+    Lk = [0.3*random_matrix() for i in range(0, num_L)]
+    dop_0 = numpy.dot(H, H.conj().transpose())
+    dop_0 = 0.5*(dop_0 + dop_0.conj().transpose())
+    return (H, Lk, dop_0/numpy.trace(dop_0))
+
+
+def _qubit_signal(num_samples):
+    """
+    a qubit's evolution with num_samples samples
+    """
+    H = numpy.array([[0., 1.], [1., 0.]], dtype=complex)
+    Lk = [numpy.array([[0., 0.3], [0., 0.]], dtype=complex)]
+    dop_0 = numpy.array([[1., 0.], [0., 0.]], dtype=complex)
+    return lme.integrate(dop_0, H, Lk, 0.001, (num_samples - 0.5)*0.001, 'expm',
+                         callback=_quiet)
+
+
+def bench_lme(n, num_L, steps, integrator, superop=False, metrics=False):
+    (H, Lk, dop_0) = _random_system(n, num_L)
+    tstep = 0.001
+    if metrics:
+        # the instrumented path
+        return lambda: lme.integrate(dop_0, H, Lk, tstep, (steps + 0.5)*tstep, integrator,
+                                     superop=superop, metrics={})
+    return lambda: lme.integrate(dop_0, H, Lk, tstep, (steps + 0.5)*tstep, integrator,
+                                 superop=superop, callback=_quiet)
+
+
+def bench_fme(n, steps, integrator):
+    (H, Lk, dop_0) = _random_system(n, 2)
+    tstep = 0.001
+    return lambda: fme.integrate(dop_0, H, Lk[0], Lk[1], tstep, (steps + 0.5)*tstep, integrator,
+                                 callback=_quiet)
+
+
+def bench_hermitian_subspace_generator(n):
+    (H, Lk, dop_0) = _random_system(n, 2)
+    return lambda: util.hermitian_subspace_generator(lambda dop: lme._dt(dop, H, Lk), n)
+
+
+def bench_bloch_vector(num_samples):
+    evo = _qubit_signal(num_samples)
+    return lambda: bloch.vector(evo)
+
+
+def bench_signal_append(n, num_samples):
+    dop = numpy.identity(n, dtype=complex)/n
+    def run():
+        signal = Signal()
+        for i in range(0, num_samples):
+            signal.append(i*0.001, dop)
+    return run
+
+
+def bench_upper_triang_trajectories(n, num_samples):
+    (H, Lk, dop_0) = _random_system(n, 1)
+    evo = lme.integrate(dop_0, H, Lk, 0.001, (num_samples - 0.5)*0.001, 'expm',
+                        callback=_quiet)
+    return lambda: evo.upper_triang_trajectories()
+
+
+def bench_matlab_stream(num_samples):
+    evo = _qubit_signal(num_samples)
+    return lambda: matlab.stream_trajectories_with_bound(evo, -1.)
+
+
+def bench_matlab_mat(num_samples):
+    import os
+    import tempfile
+    evo = _qubit_signal(num_samples)
+    (fd, file_name) = tempfile.mkstemp(suffix='.mat')
+    os.close(fd)
+    def run():
+        matlab.save_signal_mat(file_name, evo, -1.)
+        os.remove(file_name)
+    return run
+
+
+def cases(quick=False):
+    """
+    the list of (name, params, factory) benchmark cases, factory(**params)
+    returning the function to time
+    """
+    sizes = (2, 4, 8)
+    steps = (1000, 10000)
+    if quick:
+        sizes = (2, 4)
+        steps = (1000,)
+
+    result = []
+    for integrator in ('euler', 'rk4'):
+        for n in sizes:
+            for num_L in (1, 4):
+                for num_steps in steps:
+                    for superop in (False, True):
+                        result.append(('lme.integrate',
+                                       {'integrator' : integrator, 'n' : n, 'num_L' : num_L,
+                                        'steps' : num_steps, 'superop' : superop},
+                                       bench_lme))
+    for integrator in ('euler', 'rk4'):
+        result.append(('lme.integrate',
+                       {'integrator' : integrator, 'n' : 4, 'num_L' : 1, 'steps' : steps[-1],
+                        'superop' : False, 'metrics' : True},
+                       bench_lme))
+    for n in sizes:
+        result.append(('fme.integrate',
+                       {'integrator' : 'rk4', 'n' : n, 'steps' : steps[-1]}, bench_fme))
+        result.append(('util.hermitian_subspace_generator', {'n' : n},
+                       bench_hermitian_subspace_generator))
+        result.append(('Signal.upper_triang_trajectories',
+                       {'n' : n, 'num_samples' : 10*steps[-1]}, bench_upper_triang_trajectories))
+    result.append(('Signal.append', {'n' : 4, 'num_samples' : 10*steps[-1]},
+                   bench_signal_append))
+    result.append(('bloch.vector', {'num_samples' : 10*steps[-1]}, bench_bloch_vector))
+    result.append(('matlab.stream_trajectories_with_bound', {'num_samples' : steps[-1]},
+                   bench_matlab_stream))
+    result.append(('matlab.save_signal_mat', {'num_samples' : 10*steps[-1]},
+                   bench_matlab_mat))
+    return result
+
+
+def _key(name, params):
+    return name + ' ' + json.dumps(params, sort_keys=True)
+
+
+def _run_case(factory, params, repeat, queue):
+    """
+    time a case; runs in a forked process and puts (seconds, peak rss
+    growth, error) on queue
+    """
+    try:
+        run = factory(**params)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        best = None
+        for i in range(0, repeat):
+            start = time.time()
+            run()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put((best, rss_after - rss_before, None))
+    except Exception:
+        queue.put((None, None, traceback.format_exc()))
+
+
+def _wait_case(process, queue, poll=1.):
+    """
+    the result of a case, or an error result if its process died without
+    reporting one, ie. killed by the OS
+    """
+    while True:
+        try:
+            return queue.get(timeout=poll)
+        except Queue.Empty:
+            if process.exitcode is not None:
+                break
+    # the process may have reported just before exiting
+    try:
+        return queue.get(timeout=poll)
+    except Queue.Empty:
+        return (None, None, 'process exited with code %d' % process.exitcode)
+
+
+def run(quick=False, repeat=3, verbose=True):
+    """
+    run all the cases, returning a list of result dicts
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    results = []
+    for (name, params, factory) in cases(quick):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_run_case,
+                                          args=(factory, params, repeat, queue))
+        process.start()
+        (seconds, peak_rss_kb, error) = _wait_case(process, queue)
+        process.join()
+        results.append({'name' : name,
+                        'params' : params,
+                        'seconds' : seconds,
+                        'peak_rss_growth_kb' : peak_rss_kb,
+                        'error' : error,
+                        'commit' : commit})
+        if not verbose:
+            continue
+        if error:
+            sys.stderr.write('%-70s FAILED\n%s\n' % (_key(name, params), error))
+        else:
+            sys.stderr.write('%-70s %10.4fs %8dkB\n' % (_key(name, params), seconds, peak_rss_kb))
+    return results
+
+
+def compare(results, baseline, threshold=1.2):
+    """
+    pairs of results of the same cases, as (key, baseline seconds, seconds,
+    ratio, regressed) tuples; a case regressed when it got slower than
+    threshold times the baseline, failed cases are skipped
+    """
+    baseline_seconds = {}
+    for result in baseline:
+        if result.get('error'):
+            continue
+        baseline_seconds[_key(result['name'], result['params'])] = result['seconds']
+
+    comparison = []
+    for result in results:
+        key = _key(result['name'], result['params'])
+        if key not in baseline_seconds or result['error']:
+            continue
+        ratio = result['seconds']/max(baseline_seconds[key], 1e-9)
+        comparison.append((key, baseline_seconds[key], result['seconds'], ratio,
+                           ratio > threshold))
+    return comparison
+
+
+def main(argv):
+    import optparse
+    parser = optparse.OptionParser(usage='python -m qds.bench [options]')
+    parser.add_option('--quick', action='store_true', default=False,
+                      help='smaller sizes and step counts')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='repetitions per case, the best one is kept')
+    parser.add_option('--out', default=None,
+                      help='write the results to this JSON file')
+    parser.add_option('--compare', default=None,
+                      help='JSON results of a previous run to compare against')
+    parser.add_option('--threshold', type='float', default=1.2,
+                      help='slowdown ratio reported as a regression')
+    (options, args) = parser.parse_args(argv)
+
+    results = run(options.quick, options.repeat)
+    if options.out:
+        f = open(options.out, 'w')
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+
+    failures = len([result for result in results if result['error']])
+    if not options.compare:
+        return int(failures > 0)
+    f = open(options.compare, 'r')
+    baseline = json.load(f)
+    f.close()
+    regressions = 0
+    for (key, before, after, ratio, regressed) in compare(results, baseline, options.threshold):
+        flag = ''
+        if regressed:
+            flag = ' REGRESSION'
+            regressions = regressions + 1
+        sys.stderr.write('%-70s %10.4fs -> %10.4fs (x%.2f)%s\n' % (key, before, after, ratio, flag))
+    return int(regressions > 0 or failures > 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -23,80 +23,69 @@ import hs
 import pauli 
 import numpy
 
-def vector(evo):
+_XYZ = numpy.array([pauli.X, pauli.Y, pauli.Z])
+
+def vector(evo, check_hermitian=True, tol=1e-9):
+    """
+    Bloch vector coordinates of a qubit's evolution as a (T, 3) real array
+        evo              a Signal of 2*2 density operators
+        check_hermitian  if True assert that all the samples are hermitian
+                         up to tol
+        tol              tolerance of the hermiticity check
+    """
     assert len(evo)
-    (time,dop) = evo[0]
-    assert dop.shape[0] == dop.shape[1] == 2
+    dops = evo.values
+    assert dops.shape[1] == dops.shape[2] == 2
+
+    if check_hermitian:
+        assert numpy.abs(dops - dops.conj().transpose(0, 2, 1)).max() <= tol
+
+    # coordinates in the basis X, Y, Z
+    return numpy.real(hs.dots(_XYZ, dops).transpose())
 
-    # bloch vector coordinates
-    vector = None
-    for i in range(0,len(evo)):
-        (time,dop) = evo[i]
-        assert (dop == numpy.conjugate(numpy.transpose(dop))).all()
-        x = hs.dot(pauli.X,dop)
-        y = hs.dot(pauli.Y,dop)
-        z = hs.dot(pauli.Z,dop)
-        entry = numpy.array([x,y,z])
-        if vector is None:
-            vector = entry
-        else:
-            vector = numpy.vstack([vector,entry])
-            
-    return vector
 
+# Pauli basis I, X, Y, Z and Levi-Civita symbol
+_IXYZ = numpy.array([pauli.I, pauli.X, pauli.Y, pauli.Z])
+_EPSILON = numpy.zeros((3,3,3))
+for (j,k,p) in [(0,1,2),(1,2,0),(2,0,1)]:
+    _EPSILON[j,k,p] = 1.
+    _EPSILON[k,j,p] = -1.
 
 def bloch_sphere(osr_generators):
-    assert len(osr_generators)
-    for E in osr_generators:
-        assert E.shape[0] == E.shape[1] == 2
+    """
+    affine Bloch sphere representation r -> M*r + c of the qubit channel
+    with the given operator-sum representation
+        osr_generators  the channel's Kraus operators, a sequence of 2*2
+                        matrices or a (K, 2, 2) array; a (B, K, 2, 2) array
+                        holds B channels with K operators each
 
-    import pauli 
+    returns a tuple (M, c) with M of shape (3, 3) and c of shape (3,), or
+    with shapes (B, 3, 3) and (B, 3) for B channels
+    """
+    E = numpy.asarray(osr_generators)
+    assert E.ndim in (3, 4) and E.shape[-3]
+    assert E.shape[-1] == E.shape[-2] == 2
+    batched = (E.ndim == 4)
+    if not batched:
+        E = E[numpy.newaxis]
 
-    alpha_i = []
-    a_i_k = []
-    for E in osr_generators:
-        # coordinates in the basis I, X, Y e Z
-        alpha_i.append(operator.hs_dot(pauli.I,E)/2.)
-        a_i_k.append([operator.hs_dot(pauli.X,E)/2., \
-                      operator.hs_dot(pauli.Y,E)/2., \
-                      operator.hs_dot(pauli.Z,E)/2. ])
+    # coordinates in the basis I, X, Y, Z: E_l = alpha_l*I + sum_k a_lk*sigma_k
+    coords = numpy.einsum('pij,nlij->nlp', _IXYZ.conj(), E)/2.
+    alpha = coords[:,:,0]
+    a = coords[:,:,1:]
 
-    print alpha_i
-    print a_i_k
-        
-    # build M and c
-    M = numpy.zeros((3,3))
-    c = numpy.zeros((3,1))
-    for j in [0,1,2]:
-        for k in [0,1,2]:
-            for l in range(0,len(osr_generators)):
-                M[j][k] = M[j][k] + a_i_k[l][j]*numpy.conj(a_i_k[l][k]) + \
-                                    numpy.conj(a_i_k[l][j])*a_i_k[l][k]
-                if j == k:
-                    abs_alpha = numpy.abs(alpha_i[l]) 
-                    M[j][k] = M[j][k] + abs_alpha*abs_alpha
-                    for p in [0,1,2]:
-                        M[j][k] = M[j][k] - a_i_k[l][p]*numpy.conj(a_i_k[l][p])
+    # M_jk = sum_l (|alpha_l|^2 - |a_l|^2)*delta_jk + 2*Re(a_lj*conj(a_lk))
+    #                + 2*eps_jkp*Im(conj(alpha_l)*a_lp)
+    diag = (numpy.abs(alpha)**2 - (numpy.abs(a)**2).sum(axis=2)).sum(axis=1)
+    M = diag[:,numpy.newaxis,numpy.newaxis]*numpy.identity(3) \
+        + 2.*numpy.real(numpy.einsum('nlj,nlk->njk', a, a.conj())) \
+        + 2.*numpy.einsum('jkp,nlp->njk', _EPSILON,
+                          numpy.imag(alpha.conj()[:,:,numpy.newaxis]*a))
 
-                for p in [0,1,2]:
-                    e_j_k_p = 0.
-                    if (j,k,p) in [(0,1,2),(1,2,0),(2,0,1)]:
-                        e_j_k_p = 1.
-                    elif (j,k,p) in [(2,1,0),(1,0,2),(0,2,1)]:
-                        e_j_k_p = -1.
-                    M[j][k] = M[j][k] + e_j_k_p*complex(0, alpha_i[l]*numpy.conj(a_i_k[l][p]) \
-                                                            -numpy.conj(alpha_i[l])*a_i_k[l][p])
-              
-    for k in [0,1,2]:
-        for l in range(0,len(osr_generators)):
-            for j in [0,1,2]:
-                for p in [0,1,2]:
-                    e_j_p_k = 0.
-                    if (j,p,k) in [(0,1,2),(1,2,0),(2,0,1)]:
-                        e_j_p_k = 1.
-                    elif (j,p,k) in [(2,1,0),(1,0,2),(0,2,1)]:
-                        e_j_p_k = -1.
+    # c_k = sum_l 2*Re(conj(alpha_l)*a_lk) + i*eps_jpk*a_lj*conj(a_lp)
+    c = 2.*numpy.real(alpha.conj()[:,:,numpy.newaxis]*a).sum(axis=1) \
+        + numpy.real(1j*numpy.einsum('jpk,nlj,nlp->nk', _EPSILON, a, a.conj()))
 
-                    c[k] = c[k] + complex(0,2)*e_j_p_k*a_i_k[l][j]*numpy.conj(a_i_k[l][p])
-    print M
-    print c
+    if not batched:
+        return (M[0], c[0])
+    return (M, c)
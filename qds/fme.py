@@ -47,7 +47,7 @@ def corresponding_lme_operators(H, M, F):
     return (H_lme, L_lme)
 
 
-def integrate(dop_0, H, M, F, tstep, tf, integrator='euler'):
+def integrate(dop_0, H, M, F, tstep, tf, integrator='euler', callback=None, metrics=None):
     """
     integrate the Wiseman-Wilburn Markovian Feedback Master equation
     	dop_0	      system's initial state as a density operator
@@ -56,12 +56,19 @@ def integrate(dop_0, H, M, F, tstep, tf, integrator='euler'):
         F             feedback operator
     	tstep	      simulation step time
     	tf	      simulation finish time
-        integrator    'euler' or 'rk4' for runge-kutta' 4th order method
+        integrator    'euler', 'rk4' or 'expm', see lme.integrate()
+        callback      progress callback, see lme.integrate()
+        metrics       a dict filled as by lme.integrate(), plus the LME
+                      operators 'H_lme' and 'L_lme'
     """
     # matrices checks are done in corresponding_lme_operators()
     # and in lme.integrate()
     
     (H_lme, L_lme) = corresponding_lme_operators(H, M, F)
-    print  (H_lme, L_lme)
-    return lme.integrate(dop_0,  H_lme, (L_lme), tstep, tf)
+    evo = lme.integrate(dop_0,  H_lme, (L_lme,), tstep, tf, integrator,
+                        callback=callback, metrics=metrics)
+    if metrics is not None:
+        metrics['H_lme'] = H_lme
+        metrics['L_lme'] = L_lme
+    return evo
 
@@ -28,11 +28,32 @@ def dot(A,B):
     assert A.shape[0] == B.shape[0] \
            and A.shape[1] == B.shape[1]
 
-    return numpy.trace(numpy.dot(A.conj().transpose(), B))
+    # tr(adj(A)B) is the sum of the elementwise products conj(A)*B
+    return numpy.vdot(A, B)
 
 def norm(A):
     """
     Norm induced by the Hilbert-Schmidt inner product
     """
-    return numpy.sqrt(dot(A,A))
+    return numpy.sqrt(numpy.real(dot(A,A)))
+
+def dots(As, Bs):
+    """
+    Hilbert-Schmidt inner products between two stacks of matrices:
+    returns the K*T matrix of <As[k],Bs[t]> for As of shape (K, n, m)
+    and Bs of shape (T, n, m)
+    """
+    assert As.ndim == Bs.ndim == 3
+    assert As.shape[1:] == Bs.shape[1:]
+
+    K = As.shape[0]
+    T = Bs.shape[0]
+    return numpy.dot(As.reshape(K, -1).conj(), Bs.reshape(T, -1).transpose())
+
+def norms(As):
+    """
+    Hilbert-Schmidt norms of a (K, n, m) stack of matrices
+    """
+    assert As.ndim == 3
+    return numpy.sqrt((numpy.abs(As.reshape(As.shape[0], -1))**2).sum(axis=1))
 
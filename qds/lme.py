@@ -19,13 +19,15 @@
 #    3. This notice may not be removed or altered from any source
 #    distribution.
 
+import os
 import time
+import pickle
 import numpy
 import operator
 import util
 import hs
 
-from signal import Signal
+from signal import Signal, DiskSignal
 
 def hamiltonian_dt(dop, H):
     """
@@ -62,12 +64,242 @@ def _dt(dop, H, Lk, dt_func_data=None, integrator_time=None):
     return hamiltonian_dt(dop, H) + lindbladian_dt(dop, Lk)
 
 
+def _issparse(A):
+    """
+    True if A is a scipy.sparse matrix
+    """
+    try:
+        import scipy.sparse
+    except ImportError:
+        return False
+    return scipy.sparse.issparse(A)
+
+
+def _is_hermitian(A):
+    """
+    exact hermiticity check for both dense and scipy.sparse matrices
+    """
+    if _issparse(A):
+        return (A != A.conj().transpose()).nnz == 0
+    return (A == A.conj().transpose()).all()
+
+
+def liouvillian(H, Lk, sparse=False):
+    """
+    vectorized LME generator as a n^2*n^2 superoperator acting on the
+    row-stacked density operator, ie. dop.reshape(-1)
+	H       system's Hamiltonian
+	Lk      the sequence of Lindblad operators
+        sparse  if True H and Lk may be scipy.sparse matrices and the
+                superoperator is returned as a scipy.sparse CSR matrix
+    """
+    n = H.shape[0]
+    if sparse:
+        import scipy.sparse
+        kron = scipy.sparse.kron
+        I = scipy.sparse.identity(n, format='csr')
+        H = scipy.sparse.csr_matrix(H)
+        Lk = [scipy.sparse.csr_matrix(L) for L in Lk]
+    else:
+        kron = numpy.kron
+        I = numpy.identity(n)
+
+    # with row stacking vec(A*X*B) = kron(A, B^T)*vec(X)
+    superop = numpy.complex(0.,-1.)*(kron(H, I) - kron(I, H.transpose()))
+    for L in Lk:
+        L_adj_L = L.conj().transpose().dot(L)
+        superop = superop + kron(L, L.conj()) \
+                          -0.5*(kron(L_adj_L, I) + kron(I, L_adj_L.transpose()))
+    if sparse:
+        return superop.tocsr()
+    return superop
+
+
+def _superop_dt(dop, H, Lk, dt_func_data, integrator_time=None):
+    """
+    LME time derivative using a precompiled superoperator
+        dop              system's state as a density operator
+	H                unused here
+	Lk	         unused here
+        dt_func_data     the superoperator returned by liouvillian(), dense
+                         or sparse
+        integrator_time  unused here
+    """
+    return dt_func_data.dot(dop.reshape(-1)).reshape(dop.shape)
+
+
+def propagator(H, Lk, t):
+    """
+    exact propagator exp(t*liouvillian(H, Lk)) acting on the row-stacked
+    density operator
+	H       system's Hamiltonian
+	Lk      the sequence of Lindblad operators
+        t       propagation time [s]
+    """
+    import scipy.linalg
+    return scipy.linalg.expm(t*liouvillian(H, Lk))
+
+
+def evolve(dop_0, H, Lk, times, max_cond=1e8):
+    """
+    state of the LME at arbitrary times, without stepping through the
+    intermediate ones
+    	dop_0	      system's initial state as a density operator
+	H	      system's Hamiltonian
+	Lk	      the sequence of Lindblad operators
+        times         sequence of times [s] at which the state is wanted
+        max_cond      if the eigenvectors of the generator are worse
+                      conditioned than this, exp(t*L) is computed by
+                      scaling-and-squaring for each time instead
+    """
+    superop = liouvillian(H, Lk)
+    vec_0 = dop_0.reshape(-1)
+
+    evo = Signal('Density op. evolution', capacity=max(len(times), 1))
+    (w, V) = numpy.linalg.eig(superop)
+    if numpy.linalg.cond(V) < max_cond:
+        coeffs = numpy.linalg.solve(V, vec_0)
+        for t in times:
+            vec = numpy.dot(V, numpy.exp(w*t)*coeffs)
+            evo.append(t, vec.reshape(dop_0.shape))
+    else:
+        import scipy.linalg
+        for t in times:
+            vec = numpy.dot(scipy.linalg.expm(t*superop), vec_0)
+            evo.append(t, vec.reshape(dop_0.shape))
+    return evo
+
+
+def hermitian_subspace_generator(H, Lk):
+    """
+    the LME generator acting on the real Hermitian subspace of n*n complex
+    matrices, see util.hermitian_subspace_generator(); closed-form fast path
+    through the superoperator
+	H       system's Hamiltonian
+	Lk      the sequence of Lindblad operators
+    """
+    return util.hermitian_subspace_superop(liouvillian(H, Lk), H.shape[0])
+
+
+def steady_state(H, Lk, method='dense', tol=1e-10):
+    """
+    stationary state of the LME, solving for the null space of the
+    generator with the trace-one constraint
+	H       system's Hamiltonian
+	Lk      the sequence of Lindblad operators
+        method  'dense' for a direct dense solve, 'sparse' for a direct
+                sparse one (scipy.sparse.linalg.spsolve) or 'iterative'
+                for GMRES; H and Lk may be scipy.sparse matrices with the
+                last two
+        tol     relative tolerance of the 'iterative' method
+
+    the generator must have a unique stationary state
+    """
+    assert method in ('dense', 'sparse', 'iterative')
+    n = H.shape[0]
+    # vec(I), so that numpy.dot(trace_row, vec(dop)) = tr(dop)
+    trace_row = numpy.identity(n).reshape(-1)
+
+    # the generator is trace preserving, its range is orthogonal to
+    # trace_row: adding the rank one term outer(trace_row, trace_row)
+    # makes it invertible and the solution of A*x = trace_row has trace one
+    if method == 'dense':
+        A = liouvillian(H, Lk) + numpy.outer(trace_row, trace_row)
+        vec = numpy.linalg.solve(A, trace_row)
+    else:
+        import scipy.sparse
+        import scipy.sparse.linalg
+        T = scipy.sparse.csr_matrix(trace_row)
+        A = (liouvillian(H, Lk, sparse=True) + T.transpose()*T).tocsc()
+        if method == 'sparse':
+            vec = scipy.sparse.linalg.spsolve(A, trace_row)
+        else:
+            (vec, info) = scipy.sparse.linalg.gmres(A, trace_row, tol=tol, restart=min(n*n, 100),
+                                                     maxiter=10*n*n)
+            assert info == 0, 'gmres did not converge'
+
+    dop = vec.reshape((n, n))
+    dop = 0.5*(dop + dop.conj().transpose())
+    return dop/numpy.trace(dop)
+
+
+def _num_steps(tstep, tf):
+    """
+    number of integration steps of the time grid 0, tstep, 2*tstep, ...
+    up to tf, tf included when it is a multiple of tstep up to rounding;
+    the grid shared by all the integrators
+    """
+    return int(numpy.floor(tf/tstep*(1. + 1e-12)))
+
+
+def _control_values(controls, tstep, times):
+    """
+    coefficients of the control Hamiltonians at times; returns the
+    (num_times, K) table
+        controls   sequence of (H_k, f_k), see integrate()
+    """
+    coeffs = numpy.empty((len(times), len(controls)))
+    for (k, (H_k, f_k)) in enumerate(controls):
+        if callable(f_k):
+            coeffs[:,k] = f_k(times)
+        else:
+            # samples every tstep, linearly interpolated in between
+            f_k = numpy.asarray(f_k, dtype=float)
+            coeffs[:,k] = numpy.interp(times, numpy.arange(len(f_k))*tstep, f_k)
+    return coeffs
+
+
+def _control_coeffs(controls, tstep, tf):
+    """
+    coefficients of the control Hamiltonians evaluated on the half-step
+    time grid 0, tstep/2, tstep, ... covering [0, tf + tstep]; returns the
+    (num_times, K) table
+        controls   sequence of (H_k, f_k), see integrate()
+    """
+    num_steps = _num_steps(tstep, tf) + 1
+    for (H_k, f_k) in controls:
+        if not callable(f_k):
+            f_k = numpy.asarray(f_k)
+            assert f_k.ndim == 1 and len(f_k) >= num_steps
+    half_times = numpy.arange(0, 2*num_steps + 1)*(0.5*tstep)
+    return _control_values(controls, tstep, half_times)
+
+
+def _control_dt(dop, H, Lk, dt_func_data, integrator_time):
+    """
+    LME time derivative with the time-dependent Hamiltonian
+    H(t) = H + sum_k f_k(t)*H_k
+        dop              system's state as a density operator
+	H                unused here, folded into dt_func_data
+	Lk	         unused here, folded into dt_func_data
+        dt_func_data     tuple (superop, Hs, half_step, coeffs, controls) with
+                         the superoperator of the time-independent part,
+                         the (K, n, n) stack of control Hamiltonians, their
+                         coefficients on the half-step grid and the
+                         controls themselves
+        integrator_time  time at which the derivative is evaluated [s]
+    """
+    (superop, Hs, half_step, coeffs, controls) = dt_func_data
+    pos = integrator_time/half_step
+    i = int(round(pos))
+    if abs(pos - i) < 1e-9:
+        f = coeffs[i]
+    else:
+        # off the grid, ie. for the 'rk45' integrator, evaluate the
+        # controls at the stage time so the error control sees them
+        f = _control_values(controls, 2.*half_step, numpy.array([integrator_time]))[0]
+
+    H_t = numpy.tensordot(f, Hs, axes=1)
+    return superop.dot(dop.reshape(-1)).reshape(dop.shape) \
+           + numpy.complex(0.,-1.)*util.comm(H_t, dop)
+
+
 def _Delta_euler(dt_func, dt_func_data, integrator_time, dop, H, Lk, tstep):
     """
     state 'increment' using Euler's method
         dt_func         function returning the time derivative
         dt_func_data    custom object available used by custom dt_func
-        integrator_time current time as reported by the integrator [s]
+        integrator_time time at the beginning of the step [s]
     	dop             system's state as a density operator
 	H               system's Hamiltonian
 	Lk	        the sequence of Lindblad operators
@@ -81,20 +313,285 @@ def _Delta_rk4(dt_func, dt_func_data, integrator_time, dop, H, Lk, tstep):
     state 'increment' using Runge-Kutta's 4th order method
         dt_func         function returning the time derivative
         dt_func_data    custom object available used by custom dt_func
-        integrator_time current time as reported by the integrator [s]
+        integrator_time time at the beginning of the step [s]
     	dop             system's state as a density operator
 	H               system's Hamiltonian
 	Lk	        the sequence of Lindblad operators
         tstep           time length of the integration step [s]
     """
     k1 = dt_func(dop, H, Lk, dt_func_data, integrator_time)
-    k2 = dt_func(dop + 0.5*tstep*k1, H, Lk, dt_func_data, integrator_time)
-    k3 = dt_func(dop + 0.5*tstep*k2, H, Lk, dt_func_data, integrator_time)
-    k4 = dt_func(dop + tstep*k3, H, Lk, dt_func_data, integrator_time)
+    k2 = dt_func(dop + 0.5*tstep*k1, H, Lk, dt_func_data, integrator_time + 0.5*tstep)
+    k3 = dt_func(dop + 0.5*tstep*k2, H, Lk, dt_func_data, integrator_time + 0.5*tstep)
+    k4 = dt_func(dop + tstep*k3, H, Lk, dt_func_data, integrator_time + tstep)
     return tstep*(k1/6. + k2/3. + k3/3. + k4/6.)
 
 
-def integrate(dop_0, H, Lk, tstep, tf, integrator='euler', dt_func=None, dt_func_data=None):
+def _Delta_expm(dt_func, dt_func_data, integrator_time, dop, H, Lk, tstep):
+    """
+    exact state 'increment' for time-independent H and Lk
+        dt_func         unused here
+        dt_func_data    propagator(H, Lk, tstep) minus the identity
+        integrator_time unused here
+    	dop             system's state as a density operator
+	H               unused here
+	Lk	        unused here
+        tstep           unused here, already folded into dt_func_data
+    """
+    return numpy.dot(dt_func_data, dop.reshape(-1)).reshape(dop.shape)
+
+
+# Dormand-Prince 5(4) tableau
+_DOPRI_C = (0., 1./5., 3./10., 4./5., 8./9., 1.)
+_DOPRI_A = ((),
+            (1./5.,),
+            (3./40., 9./40.),
+            (44./45., -56./15., 32./9.),
+            (19372./6561., -25360./2187., 64448./6561., -212./729.),
+            (9017./3168., -355./33., 46732./5247., 49./176., -5103./18656.))
+_DOPRI_B = (35./384., 0., 500./1113., 125./192., -2187./6784., 11./84.)
+# difference between the 5th and the embedded 4th order weights
+_DOPRI_E = (71./57600., 0., -71./16695., 71./1920., -17253./339200., 22./525., -1./40.)
+
+
+def _step_dopri5(dt_func, dt_func_data, integrator_time, dop, dop_dt, H, Lk, h):
+    """
+    one Dormand-Prince step
+        dt_func         function returning the time derivative
+        dt_func_data    custom object available used by custom dt_func
+        integrator_time time at the beginning of the step [s]
+    	dop             system's state as a density operator
+        dop_dt          time derivative at the beginning of the step
+	H               system's Hamiltonian
+	Lk	        the sequence of Lindblad operators
+        h               time length of the step [s]
+
+    returns a tuple (new_dop, new_dop_dt, err) where err is the difference
+    between the 5th and the embedded 4th order solutions
+    """
+    k = [dop_dt]
+    for i in range(1, 6):
+        stage = dop
+        for j in range(0, i):
+            stage = stage + h*_DOPRI_A[i][j]*k[j]
+        k.append(dt_func(stage, H, Lk, dt_func_data, integrator_time + _DOPRI_C[i]*h))
+
+    new_dop = dop
+    for i in range(0, 6):
+        new_dop = new_dop + h*_DOPRI_B[i]*k[i]
+    # first same as last, the derivative at the end of the step
+    k.append(dt_func(new_dop, H, Lk, dt_func_data, integrator_time + h))
+
+    err = 0.
+    for i in range(0, 7):
+        err = err + h*_DOPRI_E[i]*k[i]
+    return (new_dop, k[6], err)
+
+
+def _progress(start_time, now, steps, start_integrator_time, integrator_time, tf,
+              max_delta_dop):
+    """
+    progress report handed to the integrate() callbacks; the eta only
+    accounts for the part of the run since start_integrator_time, ie. the
+    time a checkpoint was resumed from
+    """
+    elapsed = now - start_time
+    fraction = min(integrator_time/float(tf), 1.)
+    eta = 0.
+    if integrator_time > start_integrator_time and tf > start_integrator_time:
+        run_fraction = min((integrator_time - start_integrator_time)/
+                           float(tf - start_integrator_time), 1.)
+        eta = elapsed/run_fraction*(1. - run_fraction)
+    return {'progress' : fraction,
+            'integrator_time' : integrator_time,
+            'steps' : steps,
+            'steps_per_sec' : steps/max(elapsed, 1e-9),
+            'elapsed' : elapsed,
+            'eta' : eta,
+            'max_delta_dop' : max_delta_dop}
+
+
+def _print_progress(info):
+    """
+    default integrate() callback
+    """
+    print 'in lme.sim: %d%%, ETA: %.1fmin' % (info['progress']*100., info['eta']/60.)
+
+
+def _health(integrator_time, dop):
+    """
+    numerical health of the state: a tuple (time, trace drift, hermiticity
+    drift, minimum eigenvalue of the hermitian part)
+    """
+    dop_adj = dop.conj().transpose()
+    return (integrator_time,
+            numpy.abs(1. - numpy.trace(dop)),
+            numpy.max(numpy.abs(dop - dop_adj)),
+            numpy.linalg.eigvalsh(0.5*(dop + dop_adj))[0])
+
+
+def _counting(dt_func, metrics):
+    """
+    wrap dt_func to count its calls in metrics['dt_func_calls']
+    """
+    def counted_dt_func(dop, H, Lk, dt_func_data, integrator_time):
+        metrics['dt_func_calls'] = metrics['dt_func_calls'] + 1
+        return dt_func(dop, H, Lk, dt_func_data, integrator_time)
+    return counted_dt_func
+
+
+def _integrate_adaptive(evo, dop_0, H, Lk, tstep, sample_times, dt_func, dt_func_data,
+                        rtol, atol, callback, callback_every, metrics, health_every):
+    """
+    integrate the LME with an adaptive Dormand-Prince 5(4) method; internal
+    steps are chosen by error control, starting from tstep, and the state
+    is sampled at sample_times through cubic Hermite interpolation
+        see integrate()
+    """
+    num_samples = len(sample_times)
+    t_end = sample_times[-1]
+    algo_start_time = time.time()
+    algo_last_time = algo_start_time
+
+    sample = 0
+    while sample < num_samples and sample_times[sample] <= 0.:
+        evo.append(sample_times[sample], dop_0)
+        sample = sample + 1
+
+    integrator_time = 0.
+    dop = dop_0
+    dop_dt = dt_func(dop, H, Lk, dt_func_data, integrator_time)
+    h = tstep
+    step = 0
+    rejected = 0
+    max_delta_dop = 0.
+    while sample < num_samples:
+        h = min(h, t_end - integrator_time)
+        if metrics is not None:
+            t0 = time.time()
+        (new_dop, new_dop_dt, err) = _step_dopri5(dt_func, dt_func_data, integrator_time,
+                                                  dop, dop_dt, H, Lk, h)
+        if metrics is not None:
+            t1 = time.time()
+        scale = atol + rtol*numpy.maximum(numpy.abs(dop), numpy.abs(new_dop))
+        err_norm = numpy.sqrt(numpy.mean(numpy.abs(err/scale)**2))
+        if err_norm <= 1.:
+            max_delta_dop = max(max_delta_dop, numpy.max(numpy.abs(new_dop - dop)))
+        if metrics is not None:
+            t2 = time.time()
+            metrics['time_derivative'] = metrics['time_derivative'] + t1 - t0
+            metrics['time_update'] = metrics['time_update'] + t2 - t1
+
+        if err_norm <= 1.:
+            step = step + 1
+            new_time = integrator_time + h
+            # cubic Hermite interpolation on the output grid
+            while sample < num_samples and sample_times[sample] <= new_time*(1. + 1e-12):
+                s = (sample_times[sample] - integrator_time)/h
+                h00 = (1. + 2.*s)*(1. - s)**2
+                h10 = s*(1. - s)**2
+                h01 = s*s*(3. - 2.*s)
+                h11 = s*s*(s - 1.)
+                evo.append(sample_times[sample], h00*dop + h10*h*dop_dt + h01*new_dop + h11*h*new_dop_dt)
+                sample = sample + 1
+            integrator_time = new_time
+            dop = new_dop
+            dop_dt = new_dop_dt
+            if metrics is not None:
+                metrics['time_append'] = metrics['time_append'] + time.time() - t2
+                if health_every and not step % health_every:
+                    metrics['health'].append(_health(integrator_time, dop))
+        else:
+            rejected = rejected + 1
+
+        # grow or shrink the step, at most by a factor 5
+        if err_norm == 0.:
+            factor = 5.
+        else:
+            factor = min(5., max(0.2, 0.9*err_norm**-0.2))
+        if err_norm > 1.:
+            factor = min(1., factor)
+        h = h*factor
+
+        if callback and (time.time() - algo_last_time) > callback_every:
+            algo_last_time = time.time()
+            callback(_progress(algo_start_time, algo_last_time, step, 0., integrator_time,
+                               t_end, max_delta_dop))
+
+    if metrics is not None:
+        metrics['steps'] = step
+        metrics['rejected_steps'] = rejected
+        metrics['max_delta_dop'] = max_delta_dop
+        metrics['wall_time'] = time.time() - algo_start_time
+    if callback and callback is not _print_progress:
+        callback(_progress(algo_start_time, time.time(), step, 0., integrator_time,
+                           t_end, max_delta_dop))
+    evo.flush()
+    return evo
+
+
+def _Delta_expm_sparse(dt_func, dt_func_data, integrator_time, dop, H, Lk, tstep):
+    """
+    exact state 'increment' for time-independent H and Lk, computing the
+    action of the sparse propagator without forming it
+        dt_func         unused here
+        dt_func_data    the sparse superoperator times tstep
+        integrator_time unused here
+    	dop             system's state as a density operator
+	H               unused here
+	Lk	        unused here
+        tstep           unused here, already folded into dt_func_data
+    """
+    import scipy.sparse.linalg
+    vec = dop.reshape(-1)
+    return (scipy.sparse.linalg.expm_multiply(dt_func_data, vec) - vec).reshape(dop.shape)
+
+
+def _write_checkpoint(path, state, evo, mirror):
+    """
+    atomically save the integrator state to path; an in-memory evo is
+    mirrored to the DiskSignal mirror, only appending the samples added
+    since the previous checkpoint, while a DiskSignal evo is just flushed
+    """
+    evo.flush()
+    if mirror is not None:
+        mirror.extend(evo.times[len(mirror):], evo.values[len(mirror):])
+        state['signal_path'] = None
+    else:
+        state['signal_path'] = evo.path
+    state['signal_len'] = len(evo)
+
+    f = open(path + '.tmp', 'wb')
+    pickle.dump(state, f, 2)
+    f.close()
+    os.rename(path + '.tmp', path)
+
+
+def _load_checkpoint(path):
+    """
+    the integrator state and the signal saved by _write_checkpoint(), the
+    signal's samples past the checkpoint are dropped
+    """
+    f = open(path, 'rb')
+    state = pickle.load(f)
+    f.close()
+
+    if state['signal_path']:
+        evo = DiskSignal(state['signal_path'], mode='a')
+        evo.truncate(state['signal_len'])
+    else:
+        mirror = DiskSignal(path + '.signal', mode='r')
+        evo = Signal.from_arrays(numpy.array(mirror.times[:state['signal_len']]),
+                                 numpy.array(mirror.values[:state['signal_len']]),
+                                 'Density op. evolution')
+        mirror.close()
+    return (state, evo)
+
+
+def integrate(dop_0, H, Lk, tstep, tf, integrator='euler', dt_func=None, dt_func_data=None,
+              superop=False, rtol=1e-6, atol=1e-9, signal=None, save_every=1,
+              save_times=None, sparse=None, controls=None, checkpoint=None,
+              checkpoint_every=60., resume_from=None, callback=None, callback_every=20.,
+              metrics=None, health_every=0, converge_tol=None, converge_window=10):
     """
     integrate the Lindblad Master Equation
     	dop_0	      system's initial state as a density operator
@@ -102,7 +599,11 @@ def integrate(dop_0, H, Lk, tstep, tf, integrator='euler', dt_func=None, dt_func
 	Lk	      the sequence of Lindblad operators
     	tstep	      simulation step time
     	tf	      simulation finish time
-        integrator    'euler' or 'rk4' for runge-kutta' 4th order method
+        integrator    'euler', 'rk4' for runge-kutta' 4th order method or
+                      'expm' to apply the exact one-step propagator
+                      (time-independent H and Lk only) or 'rk45' for
+                      the adaptive Dormand-Prince method, sampled every
+                      tstep
         dt_func       a function returning the LME time derivative; if defined
                       it will be used in place
                       of the dafult one. Use it to hook
@@ -112,6 +613,63 @@ def integrate(dop_0, H, Lk, tstep, tf, integrator='euler', dt_func=None, dt_func
                       {hamiltonian,lindbladian}_dt functions defined in
                       this module if you need them.
         dt_func_data  accessory data that wil be passed to dt_func
+        superop       if True build the LME superoperator once and step
+                      with one matrix-vector product per stage; can't be
+                      used together with dt_func
+        rtol, atol    relative and absolute error tolerances used by the
+                      'rk45' integrator
+        signal        an empty Signal receiving the trajectory, ie. a
+                      signal.DiskSignal for runs that don't fit in memory;
+                      defaults to a new in-memory Signal
+        save_every    only store the state every save_every steps
+        save_times    increasing sequence of times in [0, tf] at which the
+                      state is stored instead, interpolating between
+                      integration steps; overrides save_every
+        sparse        if True H and Lk are handled as scipy.sparse matrices
+                      and the run steps with a sparse superoperator, whose
+                      cost scales with its number of nonzeros; by default
+                      True when H or any of Lk is a scipy.sparse matrix
+        controls      sequence of (H_k, f_k) pairs adding the control terms
+                      sum_k f_k(t)*H_k to the Hamiltonian; f_k is either an
+                      array of samples every tstep from t=0 or a function
+                      accepting a numpy array of times. All coefficients
+                      are evaluated once on the half-step grid, 'rk45'
+                      evaluates them at its stage times instead; can't be
+                      used together with dt_func or 'expm'
+        checkpoint    file where the integrator state is saved every
+                      checkpoint_every seconds; the samples of an in-memory
+                      signal are incrementally mirrored to checkpoint.signal
+        resume_from   checkpoint file of an interrupted run to continue,
+                      bit for bit, called with the same arguments except
+                      signal, which must be omitted: the checkpoint
+                      reopens the run's DiskSignal in append mode, while
+                      a new DiskSignal(path) would truncate its samples
+        callback      function called every callback_every seconds with a
+                      dict reporting 'progress' (fraction of tf),
+                      'integrator_time', 'steps', 'steps_per_sec',
+                      'elapsed', 'eta' [s] and 'max_delta_dop', the
+                      largest state increment so far, and once more
+                      when the run ends
+        metrics       a dict filled with 'steps', 'dt_func_calls',
+                      'max_delta_dop', 'wall_time', the seconds spent in
+                      'time_derivative', 'time_update' and 'time_append',
+                      and 'health', a list of (time, trace drift,
+                      hermiticity drift, min. eigenvalue) tuples sampled
+                      every health_every steps (never if 0); with 'rk45'
+                      also 'rejected_steps', its 'time_update' including
+                      the error control
+        converge_tol  if defined stop as soon as the time derivative
+                      max|delta_dop|/tstep stays below converge_tol for
+                      converge_window consecutive steps and return the
+                      tuple (signal, convergence time), the latter being
+                      the start of that window or None if the run reached
+                      tf first. The signal is truncated there, its last
+                      sample being the converged state; with save_times
+                      it ends at the last save time reached instead.
+                      Fixed step integrators only
+
+    without callback and metrics the progress and the max_delta_dop
+    warning are printed on stdout
     """
     # check matrices orders
     assert dop_0.ndim == H.ndim == 2
@@ -123,52 +681,293 @@ def integrate(dop_0, H, Lk, tstep, tf, integrator='euler', dt_func=None, dt_func
     # check matrices props
     assert (dop_0 == dop_0.conj().transpose()).all()
     assert numpy.abs(1. - numpy.trace(dop_0)) < 0.000000001
-    assert (H == H.conj().transpose()).all()
+    assert _is_hermitian(H)
 
     # check timing params
     assert (tstep > 0) and (tf >= tstep)
+    assert save_every >= 1
+    if converge_tol is not None:
+        assert converge_tol > 0. and converge_window >= 1
+        assert integrator != 'rk45'
+    if save_times is not None:
+        save_times = numpy.asarray(save_times, dtype=float)
+        assert save_times.ndim == 1 and len(save_times)
+        assert (numpy.diff(save_times) > 0).all()
+        assert save_times[0] >= 0. and save_times[-1] <= tf
 
     # select integrator
-    assert integrator in ('euler', 'rk4')
-    Delta_func = ({'euler' : _Delta_euler, 'rk4' : _Delta_rk4})[integrator]
+    assert integrator in ('euler', 'rk4', 'expm', 'rk45')
+    if resume_from:
+        assert integrator != 'rk45'
+        assert signal is None, 'omit signal on resume, the checkpoint reopens it'
+
+    if sparse is None:
+        sparse = _issparse(H)
+        for L in Lk:
+            sparse = sparse or _issparse(L)
 
     # default to _dt for calculating LME's time derivative
-    if not dt_func:
+    if controls:
+        assert not dt_func and not sparse and integrator != 'expm'
+        for (H_k, f_k) in controls:
+            assert H_k.shape == H.shape
+            assert (H_k == H_k.conj().transpose()).all()
+        dt_func = _control_dt
+        dt_func_data = (liouvillian(H, Lk), numpy.array([H_k for (H_k, f_k) in controls]),
+                        0.5*tstep, _control_coeffs(controls, tstep, tf), controls)
+    elif integrator == 'expm' and sparse:
+        assert not dt_func
+        dt_func_data = tstep*liouvillian(H, Lk, sparse)
+    elif integrator == 'expm':
+        assert not dt_func
+        dt_func_data = propagator(H, Lk, tstep) - numpy.identity(dop_0.size)
+    elif sparse and not dt_func:
+        # the commutators in _dt only handle dense matrices
+        dt_func = _superop_dt
+        dt_func_data = liouvillian(H, Lk, sparse)
+    elif superop:
+        assert not dt_func
+        dt_func = _superop_dt
+        dt_func_data = liouvillian(H, Lk)
+    elif not dt_func:
         dt_func = _dt
 
+    quiet = callback is not None or metrics is not None
+    if callback is None and metrics is None:
+        callback = _print_progress
+    if metrics is not None:
+        metrics.update({'steps' : 0,
+                        'dt_func_calls' : 0,
+                        'max_delta_dop' : 0.,
+                        'time_derivative' : 0.,
+                        'time_update' : 0.,
+                        'time_append' : 0.,
+                        'health' : []})
+        if dt_func:
+            dt_func = _counting(dt_func, metrics)
+
+    if resume_from:
+        (state, evo) = _load_checkpoint(resume_from)
+        assert state['integrator'] == integrator and state['tstep'] == tstep
+    elif signal is None:
+        # size the signal up front
+        if save_times is not None:
+            capacity = len(save_times)
+        else:
+            capacity = _num_steps(tstep, tf)/save_every + 1
+        evo = Signal('Density op. evolution', capacity=capacity)
+    else:
+        assert not len(signal)
+        evo = signal
+
+    if integrator == 'rk45':
+        assert not checkpoint
+        assert rtol > 0. and atol > 0.
+        if save_times is None:
+            num_steps = _num_steps(tstep, tf)
+            save_times = numpy.arange(0, num_steps + 1, save_every)*tstep
+        return _integrate_adaptive(evo, dop_0, H, Lk, tstep, save_times, dt_func, dt_func_data,
+                                   rtol, atol, callback, callback_every, metrics, health_every)
+
+    Delta_func = ({'euler' : _Delta_euler,
+                   'rk4'   : _Delta_rk4,
+                   'expm'  : _Delta_expm})[integrator]
+    if integrator == 'expm' and sparse:
+        Delta_func = _Delta_expm_sparse
+
     # init simulation loop
     max_delta_dop = 0.
     algo_start_time = time.time()
     algo_last_time = algo_start_time
 
-    evo = Signal('Density op. evolution')
-    integrator_time = 0.
-    evo.append(integrator_time, dop_0)
-    integrator_time = integrator_time + tstep 
-    dop = dop_0
+    checkpoint_last_time = algo_start_time
+    mirror = None
 
-    while integrator_time <= tf:
-        # integrator_time may be needed in state tracking controller
-        delta_dop = Delta_func(dt_func, dt_func_data, integrator_time, dop, H, Lk, tstep)
+    if resume_from:
+        dop = state['dop']
+        integrator_time = state['integrator_time']
+        step = state['step']
+        next_save = state['next_save']
+        max_delta_dop = state['max_delta_dop']
+        converged_steps = state.get('converged_steps', 0)
+    else:
+        integrator_time = 0.
+        step = 0
+        next_save = 0
+        converged_steps = 0
+        if save_times is None:
+            evo.append(integrator_time, dop_0)
+        else:
+            while next_save < len(save_times) and save_times[next_save] <= 0.:
+                evo.append(save_times[next_save], dop_0)
+                next_save = next_save + 1
+        integrator_time = tstep
+        dop = dop_0
+
+    if checkpoint and not isinstance(evo, DiskSignal):
+        mode = 'w'
+        if resume_from == checkpoint:
+            mode = 'a'
+        mirror = DiskSignal(checkpoint + '.signal', 'Density op. evolution', mode=mode)
+        mirror.truncate(min(len(mirror), len(evo)))
+
+    first_step = step
+    first_time = integrator_time - tstep
+    convergence_time = None
+    num_steps = _num_steps(tstep, tf)
+    # with save_times keep going until the last one has been stored, it may
+    # lie past the last step by rounding
+    while step < num_steps or \
+          (save_times is not None and next_save < len(save_times)):
+        if metrics is not None:
+            t0 = time.time()
+        # integrator_time may be needed in state tracking controller, the
+        # step goes from integrator_time - tstep to integrator_time
+        delta_dop = Delta_func(dt_func, dt_func_data, integrator_time - tstep, dop, H, Lk, tstep)
+        if metrics is not None:
+            t1 = time.time()
         new_max_delta_dop = numpy.max(numpy.abs(delta_dop))
         if new_max_delta_dop > max_delta_dop:
             max_delta_dop = new_max_delta_dop
-        dop = dop + delta_dop
+        new_dop = dop + delta_dop
+        if metrics is not None:
+            t2 = time.time()
         #TODO: should print out a measure of the 'drift' from 'hermitianicity'
         #assert (dop == dop.conj().transpose()).all()
         #assert numpy.trace(dop) == 1
-        evo.append(integrator_time,dop)
-        integrator_time = integrator_time + tstep 
+        step = step + 1
+        if save_times is None:
+            if not step % save_every:
+                evo.append(integrator_time, new_dop)
+        else:
+            # linear interpolation between the last two steps
+            while next_save < len(save_times) and save_times[next_save] <= integrator_time:
+                s = (save_times[next_save] - (integrator_time - tstep))/tstep
+                evo.append(save_times[next_save], (1. - s)*dop + s*new_dop)
+                next_save = next_save + 1
+        if metrics is not None:
+            t3 = time.time()
+            metrics['time_derivative'] = metrics['time_derivative'] + t1 - t0
+            metrics['time_update'] = metrics['time_update'] + t2 - t1
+            metrics['time_append'] = metrics['time_append'] + t3 - t2
+            if health_every and not step % health_every:
+                metrics['health'].append(_health(integrator_time, new_dop))
+        dop = new_dop
+        integrator_time = (step + 1)*tstep
+
+        if converge_tol is not None:
+            if new_max_delta_dop < converge_tol*tstep:
+                converged_steps = converged_steps + 1
+            else:
+                converged_steps = 0
+            if converged_steps >= converge_window:
+                convergence_time = integrator_time - (converged_steps + 1)*tstep
+                if save_times is None and step % save_every:
+                    evo.append(integrator_time - tstep, dop)
+                break
  
-        if (time.time() - algo_last_time) > 20.:
+        if callback and (time.time() - algo_last_time) > callback_every:
             algo_last_time = time.time()
-            progress = integrator_time/float(tf)*100.
-            ETA_min = (algo_last_time - algo_start_time) \
-                            /integrator_time*(tf - integrator_time)/60.
-            print 'in lme.sim: %d%%, ETA: %.1fmin' % (progress, ETA_min)
+            callback(_progress(algo_start_time, algo_last_time, step - first_step,
+                               first_time, integrator_time - tstep, tf, max_delta_dop))
+
+        if checkpoint and (time.time() - checkpoint_last_time) > checkpoint_every:
+            checkpoint_last_time = time.time()
+            _write_checkpoint(checkpoint, {'integrator' : integrator,
+                                           'tstep' : tstep,
+                                           'dop' : dop,
+                                           'integrator_time' : integrator_time,
+                                           'step' : step,
+                                           'next_save' : next_save,
+                                           'max_delta_dop' : max_delta_dop,
+                                           'converged_steps' : converged_steps},
+                              evo, mirror)
+
+    if callback and callback is not _print_progress:
+        callback(_progress(algo_start_time, time.time(), step - first_step,
+                           first_time, integrator_time - tstep, tf, max_delta_dop))
+    if metrics is not None:
+        metrics['steps'] = step
+        metrics['max_delta_dop'] = max_delta_dop
+        metrics['wall_time'] = time.time() - algo_start_time
+        if converge_tol is not None:
+            metrics['convergence_time'] = convergence_time
 
-    if max_delta_dop > 0.001:
+    # the propagator is exact, large increments are not an error there
+    if max_delta_dop > 0.001 and integrator != 'expm' and not quiet:
         print ' ! warning in lme.sim, max_delta_dop: ', max_delta_dop
 
+    evo.flush()
+    if converge_tol is not None:
+        return (evo, convergence_time)
     return evo
 
+
+
+def integrate_batch(dops_0, H, Lk, tstep, tf, integrator='euler', split=True, save_every=1):
+    """
+    integrate the Lindblad Master Equation for a whole ensemble of initial
+    states at once; the ensemble is advanced with one matrix product per
+    stage against the precompiled superoperator
+    	dops_0	      stack of initial density operators, shape (B, n, n)
+	H	      system's Hamiltonian
+	Lk	      the sequence of Lindblad operators
+    	tstep	      simulation step time
+    	tf	      simulation finish time
+        integrator    'euler', 'rk4' or 'expm', see integrate()
+        split         if True return a list with one Signal per ensemble
+                      member, else one Signal whose values are (B, n, n)
+                      stacks
+        save_every    only store the states every save_every steps
+    """
+    # check matrices orders
+    assert dops_0.ndim == 3 and H.ndim == 2
+    assert dops_0.shape[1] == dops_0.shape[2] == H.shape[0] == H.shape[1]
+    for L in Lk:
+        assert L.ndim == H.ndim
+        assert L.shape[0] == L.shape[1] == H.shape[0]
+
+    # check matrices props
+    assert (dops_0 == dops_0.conj().transpose(0, 2, 1)).all()
+    assert (numpy.abs(1. - numpy.trace(dops_0, axis1=1, axis2=2)) < 0.000000001).all()
+    assert (H == H.conj().transpose()).all()
+
+    # check timing params
+    assert (tstep > 0) and (tf >= tstep)
+    assert save_every >= 1
+
+    assert integrator in ('euler', 'rk4', 'expm')
+    # the ensemble is kept row-wise, as a (B, n*n) matrix, hence the
+    # transposed superoperators
+    if integrator == 'expm':
+        step_op = propagator(H, Lk, tstep).transpose()
+    else:
+        step_op = liouvillian(H, Lk).transpose()
+
+    num_steps = _num_steps(tstep, tf)
+    evo = Signal('Density op. ensemble evolution', capacity=num_steps/save_every + 1)
+    evo.append(0., dops_0)
+    vecs = dops_0.reshape(dops_0.shape[0], -1)
+    for step in range(1, num_steps + 1):
+        if integrator == 'euler':
+            vecs = vecs + tstep*numpy.dot(vecs, step_op)
+        elif integrator == 'rk4':
+            k1 = numpy.dot(vecs, step_op)
+            k2 = numpy.dot(vecs + 0.5*tstep*k1, step_op)
+            k3 = numpy.dot(vecs + 0.5*tstep*k2, step_op)
+            k4 = numpy.dot(vecs + tstep*k3, step_op)
+            vecs = vecs + tstep*(k1/6. + k2/3. + k3/3. + k4/6.)
+        else:
+            vecs = numpy.dot(vecs, step_op)
+
+        if not step % save_every:
+            evo.append(step*tstep, vecs.reshape(dops_0.shape))
+
+    if not split:
+        return evo
+
+    members = []
+    for b in range(0, dops_0.shape[0]):
+        name = 'Density op. evolution %d' % b
+        members.append(Signal.from_arrays(evo.times, evo.values[:,b], name))
+    return members
@@ -19,6 +19,7 @@
 #    3. This notice may not be removed or altered from any source
 #    distribution.
 
+import StringIO
 import numpy
 from signal import Signal
 
@@ -40,53 +41,72 @@ def _gen_exp(start_value, end_value, lambda_exp, tf, tstep):
 #    print exp_evo
     return exp_evo
 
+_COL_DISTANCE = 16
+_CHUNK_ROWS = 4096
+
+def _format_values(values, precision, col_distance):
+    """
+    MATLAB literals for an array of values, right aligned to col_distance
+    characters; purely real or imaginary values are written without the
+    null part
+    """
+    values_re = numpy.real(values)
+    values_im = numpy.imag(values)
+    re_str = numpy.char.mod('%%.%df' % precision, values_re)
+    im_str = numpy.char.mod('%%.%dfi' % precision, values_im)
+    both_str = numpy.char.add(re_str, numpy.char.mod('%%+.%dfi' % precision, values_im))
+
+    value_str = numpy.where(values_im != 0,
+                            numpy.where(values_re != 0, both_str, im_str),
+                            re_str)
+    if value_str.size:
+        assert numpy.char.str_len(value_str).max() < col_distance
+    return numpy.char.rjust(value_str, col_distance)
+
+
+def _write_rows(f, name, rows, precision, col_distance):
+    """
+    write the rows of a 2D array as a MATLAB matrix assignment, formatting
+    _CHUNK_ROWS rows at a time
+    """
+    assert name
+    head = name + ' = ['
+    line_start_space = ';\n' + ' '*len(head)
+    f.write(head)
+
+    for start in range(0, rows.shape[0], _CHUNK_ROWS):
+        chunk = _format_values(rows[start:start + _CHUNK_ROWS], precision, col_distance)
+        lines = [''.join(row) for row in chunk]
+        if start:
+            f.write(line_start_space)
+        f.write(line_start_space.join(lines))
+    f.write(' ];')
+
+
+def write_columns(f, data_name, columns):
+    """
+    write data columns to the file object f as a MATLAB matrix assignment
+        data_name  name of the MATLAB variable
+        columns    sequence of equally long columns, ie. the output of
+                   Signal.upper_triang_trajectories(), or a single column
+    """
+    cols = numpy.asarray(columns)
+    if cols.ndim == 1:
+        cols = cols[numpy.newaxis]
+    _write_rows(f, data_name, cols.transpose(), 6, 22)
+
+
 def _stream_columns(data_name, columns):
-    assert data_name
-    buffer = data_name + ' = ['
-    line_start_space = ';\n' + ' '*len(buffer)
-
-    # case where columns is just one list
-    try:
-        col_size = len(columns[0])
-        cols = columns
-    except:
-        cols = [columns]
-        col_size = len(cols[0])
-
-    i = 0
-    _col_distance = 22
-    while (i < col_size):
-        line = ''
-        if i:
-            line = line_start_space
-        for col in cols:
-
-            value = col[i]
-            value_re = numpy.real(value)
-            value_im = numpy.imag(value)
-
-            if value_im:
-                if value_re:
-                    value_str = '%.6f%+.6fi' % (value_re, value_im)
-                else:
-                    value_str = '%.6fi' % value_im
-            else:
-                value_str = '%.6f' % value_re
-
-            value_str_len = len(value_str)
-#            print value_str, len(value_str)
-            assert (value_str_len < _col_distance)
-
-            line += ' '*(_col_distance - value_str_len) + value_str
-
-        i = i +1
-        buffer += line   
-
-    buffer += ' ];'
-    return buffer
+    buffer = StringIO.StringIO()
+    write_columns(buffer, data_name, columns)
+    return buffer.getvalue()
 
 
-def stream_trajectories_with_bound(signal, bound_exp):
+def write_trajectories_with_bound(f, signal, bound_exp):
+    """
+    write the upper triangular trajectories of signal and an exponential
+    bound to the file object f as a MATLAB script
+    """
     assert len(signal)
 
     # only plot trajectories for the upper triangular part
@@ -94,65 +114,61 @@ def stream_trajectories_with_bound(signal, bound_exp):
     tstep = timeline[1] - timeline[0]
     tf = timeline[len(timeline) -1] + tstep
 
-    trajs = signal.upper_triang_trajectories()
-    buffer = _stream_columns('dop_data', trajs)
+    write_columns(f, 'dop_data', signal.upper_triang_trajectories())
     exp_traj = _gen_exp(0., 1., bound_exp, tf, tstep)
-    buffer += '\n\n'
-    buffer += _stream_columns('bound_data', exp_traj)
-
-    return buffer
+    f.write('\n\n')
+    write_columns(f, 'bound_data', exp_traj)
 
 
-_COL_DISTANCE = 16
+def stream_trajectories_with_bound(signal, bound_exp):
+    buffer = StringIO.StringIO()
+    write_trajectories_with_bound(buffer, signal, bound_exp)
+    return buffer.getvalue()
 
-def _value_str(value):
-    value_re = numpy.real(value)
-    value_im = numpy.imag(value)
 
-    if value_im:
-        if value_re:
-            value_str = '%.4f%+.4fi' % (value_re, value_im)
-        else:
-            value_str = '%.4fi' % value_im
-    else:
-        value_str = '%.4f' % value_re
+def write_numpy_matrix(f, name, matrix):
+    """
+    write a numpy vector or matrix to the file object f as a MATLAB
+    assignment
+    """
+    # vectors are written as columns
+    if len(matrix.shape) == 1:
+        matrix = matrix[:, numpy.newaxis]
+    _write_rows(f, name, matrix, 4, _COL_DISTANCE)
+    f.write('\n')
 
-    return value_str
 
 def stream_numpy_matrix(name, matrix):
-    assert name
+    buffer = StringIO.StringIO()
+    write_numpy_matrix(buffer, name, matrix)
+    return buffer.getvalue()
+
 
-    buffer = name + ' = ['
-    line_start_space = ';\n' + ' '*len(buffer)
-
-    # handle vectors
-    if len(matrix.shape)== 1:
-#        print "doing vector: %s\n" % name
-        for row in range(0, matrix.shape[0]):
-            line = ''
-            if row:
-                line = line_start_space
-            value_str = _value_str(matrix[row])
-            value_str_len = len(value_str)
-            #            print value_str, len(value_str)
-            assert (value_str_len < _COL_DISTANCE)
-            line += ' '*(_COL_DISTANCE - value_str_len) + value_str
-            buffer += line   
-    else:
-#        print "doing matrix: %s\n" % name
-        for row in range(0, matrix.shape[0]):
-            line = ''
-            if row:
-                line = line_start_space
-
-            for col in range(0, matrix.shape[1]):
-                value_str = _value_str(matrix[row][col])
-
-                value_str_len = len(value_str)
-                #            print value_str, len(value_str)
-                assert (value_str_len < _COL_DISTANCE)
-                line += ' '*(_COL_DISTANCE - value_str_len) + value_str
-            buffer += line   
-
-    buffer += ' ];\n'
-    return buffer
+def save_signal_mat(file_name, signal, bound_exp=None):
+    """
+    save a Signal in a binary MATLAB (v5) file with the variables
+    dop_time, dop_data (one row of upper triangular elements per sample,
+    as written by write_columns()) and dop (an n*n*T array); bound_data is
+    added if bound_exp is given
+    """
+    import scipy.io
+    assert len(signal)
+
+    timeline = numpy.asarray(signal.timeline())
+    data = {'dop_time' : timeline,
+            'dop_data' : signal.upper_triang_trajectories().transpose(),
+            'dop' : numpy.asarray(signal.values).transpose(1, 2, 0)}
+    if bound_exp is not None:
+        tstep = timeline[1] - timeline[0]
+        tf = timeline[len(timeline) -1] + tstep
+        data['bound_data'] = numpy.array(_gen_exp(0., 1., bound_exp, tf, tstep))
+    scipy.io.savemat(file_name, data, format='5', oned_as='column')
+
+
+def save_matrices_mat(file_name, matrices):
+    """
+    save numpy matrices in a binary MATLAB (v5) file
+        matrices   dict mapping MATLAB variable names to matrices
+    """
+    import scipy.io
+    scipy.io.savemat(file_name, matrices, format='5', oned_as='column')
@@ -0,0 +1,144 @@
+# Copyright (c) 2009 Riccardo Lucchese, riccardo.lucchese at gmail.com
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+
+import multiprocessing
+import numpy
+import lme
+
+from signal import Signal
+
+
+def _effective_propagator(H, Lk, tstep):
+    """
+    non-unitary propagator exp(-i*H_eff*tstep) with the effective
+    Hamiltonian H_eff = H - i/2*sum(adj(L)L)
+    """
+    import scipy.linalg
+    H_eff = H.astype(complex)
+    for L in Lk:
+        H_eff = H_eff - 0.5j*numpy.dot(L.conj().transpose(), L)
+    return scipy.linalg.expm(numpy.complex(0.,-1.)*tstep*H_eff)
+
+
+def _run_trajectories(task):
+    """
+    evolve a batch of quantum trajectories and return the sum of their
+    projectors at the saved steps; runs in the worker processes
+    """
+    (dop_0, H, Lk, tstep, num_steps, save_every, num_traj, seed) = task
+    rng = numpy.random.RandomState(seed)
+    n = dop_0.shape[0]
+    Ls = numpy.array(Lk, dtype=complex).reshape(len(Lk), n, n)
+    # the batch is kept row-wise, as a (num_traj, n) matrix
+    U_T = _effective_propagator(H, Lk, tstep).transpose()
+
+    # sample the initial pure states from the eigendecomposition of dop_0
+    (w, V) = numpy.linalg.eigh(dop_0)
+    w = numpy.clip(w, 0., None)
+    start = rng.choice(n, size=num_traj, p=w/w.sum())
+    psi = V[:, start].transpose().copy()
+    # a jump happens when the squared norm decays below the threshold
+    threshold = rng.uniform(size=num_traj)
+
+    dop_sums = numpy.zeros((num_steps/save_every + 1, n, n), dtype=complex)
+    dop_sums[0] = numpy.dot(psi.transpose(), psi.conj())
+    for step in range(1, num_steps + 1):
+        psi = numpy.dot(psi, U_T)
+        norms2 = (numpy.abs(psi)**2).sum(axis=1)
+
+        jumped = numpy.nonzero(norms2 < threshold)[0]
+        if len(jumped) and len(Ls):
+            # pick the jump operators with probabilities ||L_k*psi||^2
+            L_psi = numpy.einsum('kij,bj->bki', Ls, psi[jumped])
+            weights = (numpy.abs(L_psi)**2).sum(axis=2)
+            cumulative = numpy.cumsum(weights, axis=1)
+            draws = rng.uniform(size=len(jumped))*cumulative[:,-1]
+            k = (cumulative < draws[:,numpy.newaxis]).sum(axis=1)
+            k = numpy.minimum(k, len(Ls) - 1)
+            new_psi = L_psi[numpy.arange(len(jumped)), k]
+            psi[jumped] = new_psi/numpy.sqrt(weights[numpy.arange(len(jumped)), k])[:,numpy.newaxis]
+            threshold[jumped] = rng.uniform(size=len(jumped))
+            norms2[jumped] = 1.
+
+        if not step % save_every:
+            psi_n = psi/numpy.sqrt(norms2)[:,numpy.newaxis]
+            dop_sums[step/save_every] = numpy.dot(psi_n.transpose(), psi_n.conj())
+
+    return dop_sums
+
+
+def integrate(dop_0, H, Lk, tstep, tf, num_traj=100, processes=1, seed=None, save_every=1):
+    """
+    integrate the Lindblad Master Equation by Monte Carlo wavefunction
+    (quantum jump) unravelling: pure states evolve with the effective
+    Hamiltonian H - i/2*sum(adj(L)L) and jump through one of Lk when their
+    norm decays below a random threshold; the returned Signal holds the
+    average of their projectors
+    	dop_0	      system's initial state as a density operator, the
+                      trajectories start from its eigenvectors
+	H	      system's Hamiltonian
+	Lk	      the sequence of Lindblad operators
+    	tstep	      simulation step time, also the time resolution of
+                      the jumps
+    	tf	      simulation finish time
+        num_traj      number of trajectories
+        processes     number of processes the trajectories are spread on
+        seed          seed of the random generator, for reproducible runs
+        save_every    only store the averaged state every save_every steps
+    """
+    # check matrices orders
+    assert dop_0.ndim == H.ndim == 2
+    assert dop_0.shape[0] == dop_0.shape[1] == H.shape[0] == H.shape[1]
+    for L in Lk:
+        assert L.ndim == dop_0.ndim
+        assert L.shape[0] == L.shape[1] == dop_0.shape[0]
+
+    # check matrices props
+    assert (dop_0 == dop_0.conj().transpose()).all()
+    assert numpy.abs(1. - numpy.trace(dop_0)) < 0.000000001
+    assert (H == H.conj().transpose()).all()
+
+    # check timing params
+    assert (tstep > 0) and (tf >= tstep)
+    assert num_traj >= 1 and processes >= 1 and save_every >= 1
+
+    num_steps = lme._num_steps(tstep, tf)
+    # one independent seed per batch of trajectories
+    num_batches = min(processes, num_traj)
+    seeds = numpy.random.RandomState(seed).randint(2**31 - 1, size=num_batches)
+    tasks = []
+    for i in range(0, num_batches):
+        batch = num_traj/num_batches + (i < num_traj % num_batches)
+        tasks.append((dop_0, H, list(Lk), tstep, num_steps, save_every, batch, seeds[i]))
+
+    if processes == 1:
+        dop_sums = map(_run_trajectories, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            dop_sums = pool.map(_run_trajectories, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    dops = sum(dop_sums)/float(num_traj)
+    times = numpy.arange(0, num_steps + 1, save_every)*tstep
+    return Signal.from_arrays(times, dops, 'Density op. evolution')
@@ -24,11 +24,63 @@ from pylab import *
 
 from signal import Signal
 
-def trajectories(signal, of=None):
+def _minmax_indices(ys, num_buckets):
+    """
+    indices of the samples kept by a min/max-per-bucket decimation of ys,
+    a (k, T) array of k real series or a single one of shape (T,): the
+    samples are split in num_buckets buckets and the minimum and maximum
+    of every series in each bucket are kept, together with the first and
+    last sample
+    """
+    ys = numpy.atleast_2d(ys)
+    length = ys.shape[1]
+    if not num_buckets or length <= 2*num_buckets:
+        return numpy.arange(length)
+
+    bucket = int(numpy.ceil(length/float(num_buckets)))
+    num_buckets = int(numpy.ceil(length/float(bucket)))
+    # pad repeating the last sample, its index is kept anyway
+    padded = numpy.empty((ys.shape[0], num_buckets*bucket))
+    padded[:, :length] = ys
+    padded[:, length:] = ys[:, -1:]
+    padded = padded.reshape(ys.shape[0], num_buckets, bucket)
+
+    offsets = numpy.arange(num_buckets)*bucket
+    indices = [numpy.array([0, length - 1])]
+    indices.append((padded.argmin(axis=2) + offsets).ravel())
+    indices.append((padded.argmax(axis=2) + offsets).ravel())
+    indices = numpy.unique(numpy.concatenate(indices))
+    return indices[indices < length]
+
+
+def _num_buckets(width, num_cols=1):
+    """
+    decimation buckets for a plot spanning 1/num_cols of a figure width
+    inches wide, one per pixel column
+    """
+    return int(width*rcParams['figure.dpi']/num_cols)
+
+
+def _complex_indices(traj, num_buckets):
+    """
+    decimation of a complex trajectory preserving both its real and
+    imaginary parts
+    """
+    return _minmax_indices(numpy.vstack([numpy.real(traj), numpy.imag(traj)]), num_buckets)
+
+
+def trajectories(signal, of=None, decimate=True):
+    """
+    plot the trajectories of the upper triangular elements of signal
+        of         if given save the figure to this file instead of
+                   showing it
+        decimate   if True only plot the min/max samples for each pixel
+                   column of the subplots
+    """
     assert len(signal)
 
     # only plot trajectories for the upper triangular part
-    timeline = signal.timeline()
+    timeline = numpy.asarray(signal.timeline())
     trajs = signal.upper_triang_trajectories()
 
     figure(figsize=(20,7))      
@@ -48,14 +100,19 @@ def trajectories(signal, of=None):
         subplot(num_rows, n, i+1)
 #        real_traj =  numpy.real(trajctories[i])
 #        print numpy.real(trajectories[i])
-        plot(timeline, numpy.real(trajs[i]), 'k')
+        num_buckets = 0
+        if decimate:
+            num_buckets = _num_buckets(20, n)
+        indices = _complex_indices(trajs[i], num_buckets)
+        traj = trajs[i][indices]
+        plot(timeline[indices], numpy.real(traj), 'k')
         hold(True)
  
         # special case text and plot switch for elements on the diag.
         head = '('
         tail = ')'
         if row != col:
-            plot(timeline, numpy.imag(trajs[i]), 'k--')
+            plot(timeline[indices], numpy.imag(traj), 'k--')
         else:
             head = '<'
             tail = '>'
@@ -74,28 +131,15 @@ def trajectories(signal, of=None):
     close()
 
 
-def _gen_exp(start_value, end_value, p_0, tf, tstep):
-    exp_evo = []
-    exp_evo.append(start_value)
-    exp_time = tstep
-
-    while exp_time < tf:
-            value = (end_value - start_value)*(1. -numpy.exp(p_0*exp_time)) + start_value
-            exp_evo.append(value)
-            exp_time = exp_time + tstep
-
-#    print '\n****', start_value, end_value, p_0, tf, tstep
-#    print exp_evo
-    return exp_evo
-
-
-def trajectories_with_bound(signal, z_0, of=None):
+def trajectories_with_bound(signal, z_0, of=None, decimate=True):
+    """
+    as trajectories(), also plotting an exponential bound with rate z_0
+    for the first diagonal element
+    """
     assert len(signal)
 
     # only plot trajectories for the upper triangular part
-    timeline = signal.timeline()
-    tstep = timeline[1] - timeline[0]
-    tf = timeline[len(timeline) -1] + tstep
+    timeline = numpy.asarray(signal.timeline())
 
     trajs = signal.upper_triang_trajectories()
 
@@ -116,21 +160,28 @@ def trajectories_with_bound(signal, z_0, of=None):
         subplot(num_rows, n, i+1)
 #        real_traj =  numpy.real(trajctories[i])
 #        print numpy.real(trajectories[i])
-        plot(timeline, numpy.real(trajs[i]), 'k')
+        num_buckets = 0
+        if decimate:
+            num_buckets = _num_buckets(20, n)
+        indices = _complex_indices(trajs[i], num_buckets)
+        traj = trajs[i][indices]
+        plot(timeline[indices], numpy.real(traj), 'k')
         hold(True)
  
         # special case text and plot switch for elements on the diag.
         head = '('
         tail = ')'
         if row != col:
-            plot(timeline, numpy.imag(trajs[i]), 'k--')
+            plot(timeline[indices], numpy.imag(traj), 'k--')
         else:
             head = '<'
             tail = '>'
             # plot bounds too 
             if row==1:
-                exp_bound = _gen_exp(trajs[i][0], 1., z_0, tf, tstep)
-                plot(timeline, exp_bound, 'r')
+                start_value = numpy.real(trajs[i][0])
+                exp_time = timeline[indices] - timeline[0]
+                exp_bound = (1. - start_value)*(1. -numpy.exp(z_0*exp_time)) + start_value
+                plot(timeline[indices], exp_bound, 'r')
 
         title(''.join([head,str(row),',',str(col),tail]))
         ylim((0,1))
@@ -146,123 +197,197 @@ def trajectories_with_bound(signal, z_0, of=None):
     close()
 
 
-def mag_bars(signal, step=1):
-    tmp_file_suffix = '/tmp/qds_fig'
-    file_cleanup_list = []
-
-    from mpl_toolkits.mplot3d import Axes3D
-    from matplotlib.collections import PolyCollection
-    from matplotlib.colors import colorConverter
-    import pylab
-    import random
-    import numpy as np
-
-    (time, dop) = signal[0]
-    xpos, ypos = np.meshgrid(range(0,dop.shape[0]), range(0,dop.shape[1]))
-    xpos = xpos.flatten()
-    ypos = ypos.flatten()
-    zpos = [0] * len(xpos)
-    dx = [0.5] * len(xpos)
-    dy = [0.5] * len(xpos)
-
-#    pylab.show()
-    for i in range(0, len(signal), step):
-        print 'frame ' + str(i) +' of ' + str(len(signal))
-        tmp_filename = ''.join([tmp_file_suffix,str(i), '.png'])
-
-        (time, dop) = signal[i]
-        assert dop.shape[0] == dop.shape[1]
-        fig = figure(figsize=(2, 2)) 
-        ax = Axes3D(fig)
-        dz = numpy.abs(dop.flatten())
-        ax.bar3d(xpos, ypos, zpos, dx, dy, dz, color='b')
+# faces of the unit cube, as drawn by Axes3D.bar3d, and their shading
+_CUBE_FACES = numpy.array([[(0,0,0),(1,0,0),(1,1,0),(0,1,0)],
+                           [(0,0,1),(1,0,1),(1,1,1),(0,1,1)],
+                           [(0,0,0),(1,0,0),(1,0,1),(0,0,1)],
+                           [(0,1,0),(1,1,0),(1,1,1),(0,1,1)],
+                           [(0,0,0),(0,1,0),(0,1,1),(0,0,1)],
+                           [(1,0,0),(1,1,0),(1,1,1),(1,0,1)]], dtype=float)
+_CUBE_SHADES = numpy.array([0.5, 1., 0.7, 0.7, 0.85, 0.85])
+
+
+def _bar_verts(n, dz):
+    """
+    polygons of the n*n bars of width 0.5 and heights dz, one per face
+    """
+    ypos, xpos = numpy.divmod(numpy.arange(n*n), n)
+    origin = numpy.zeros((n*n, 1, 1, 3))
+    origin[:,0,0,0] = xpos
+    origin[:,0,0,1] = ypos
+    size = numpy.empty((n*n, 1, 1, 3))
+    size[:,0,0,0] = 0.5
+    size[:,0,0,1] = 0.5
+    size[:,0,0,2] = dz
+    return (origin + _CUBE_FACES*size).reshape(-1, 4, 3)
+
+
+class _MagBarsFigure(object):
+    """
+    one figure reused for all the frames, only the bars' polygons are
+    updated
+    """
+    def __init__(self, n):
+        from mpl_toolkits.mplot3d import Axes3D
+        from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+        from matplotlib.colors import colorConverter
+
+        self.n = n
+        self.fig = figure(figsize=(2, 2))
+        ax = Axes3D(self.fig)
+        colors = numpy.outer(numpy.tile(_CUBE_SHADES, n*n), colorConverter.to_rgb('b'))
+        self.bars = Poly3DCollection(_bar_verts(n, numpy.zeros(n*n)), facecolors=colors)
+        ax.add_collection3d(self.bars)
+        ax.set_xlim3d([0., n - 0.5])
+        ax.set_ylim3d([0., n - 0.5])
         ax.set_zlim3d([0., 1.])
-        pylab.draw()
-
-        savefig(tmp_filename, format='png')
-        file_cleanup_list.append(tmp_filename)
-        close()
 
-def traj(signal):
+    def update(self, dop):
+        self.bars.set_verts(_bar_verts(self.n, numpy.abs(dop.flatten())))
+
+    def save(self, filename):
+        self.fig.savefig(filename, format='png')
+
+    def close(self):
+        close(self.fig)
+
+
+def _mag_bars_filename(outdir, i):
+    import os
+    return os.path.join(outdir, 'qds_fig%06d.png' % i)
+
+
+def _render_mag_bars(task):
+    """
+    render a chunk of mag_bars() frames; runs in the worker processes
+    """
+    (indices, dops, outdir) = task
+    renderer = _MagBarsFigure(dops.shape[1])
+    filenames = []
+    for (i, dop) in zip(indices, dops):
+        renderer.update(dop)
+        filenames.append(_mag_bars_filename(outdir, i))
+        renderer.save(filenames[-1])
+    renderer.close()
+    return filenames
+
+
+def mag_bars(signal, step=1, outdir=None, processes=1, movie=None, writer='ffmpeg', fps=25):
+    """
+    render the magnitudes of the density operator's elements as 3D bars,
+    one frame every step samples
+        outdir      directory receiving the frames as qds_figNNNNNN.png,
+                    a new temporary directory if None
+        processes   number of processes the frames are spread on
+        movie       if given, frames are encoded straight into this
+                    video/GIF file through a matplotlib animation writer
+                    and no png is written
+        writer      name of the matplotlib animation writer used for movie,
+                    ie. 'ffmpeg' or 'imagemagick'
+        fps         frame rate of the movie
+
+    returns the list of written files
+    """
     assert len(signal)
+    assert step >= 1 and processes >= 1
     (time, dop) = signal[0]
+    assert dop.shape[0] == dop.shape[1]
+
+    indices = range(0, len(signal), step)
+    dops = signal.values[::step]
+
+    if movie:
+        import matplotlib.animation
+        renderer = _MagBarsFigure(dop.shape[0])
+        encoder = matplotlib.animation.writers[writer](fps=fps)
+        with encoder.saving(renderer.fig, movie, renderer.fig.dpi):
+            for dop in dops:
+                renderer.update(dop)
+                encoder.grab_frame()
+        renderer.close()
+        return [movie]
+
+    if outdir is None:
+        import tempfile
+        outdir = tempfile.mkdtemp(prefix='qds_fig')
+
+    if processes == 1:
+        return _render_mag_bars((indices, numpy.asarray(dops), outdir))
+
+    import multiprocessing
+    chunk = int(numpy.ceil(len(indices)/float(processes)))
+    tasks = []
+    for start in range(0, len(indices), chunk):
+        tasks.append((indices[start:start + chunk],
+                      numpy.asarray(dops[start:start + chunk]), outdir))
+    pool = multiprocessing.Pool(processes)
+    try:
+        filenames = []
+        for chunk_filenames in pool.map(_render_mag_bars, tasks):
+            filenames.extend(chunk_filenames)
+    finally:
+        pool.terminate()
+        pool.join()
+    return filenames
+
+def traj(signal, decimate=True):
+    """
+    plot the upper triangular elements of signal on the complex plane;
+    values stored as n^2*1 column-stacked vectors are reshaped
+        decimate   if True only plot the min/max samples for each pixel
+                   column of the figure
+    """
+    assert len(signal)
+    dops = signal.values
 
-    if dop.shape[1] == 1:
-        dop = numpy.reshape(dop, (numpy.sqrt(dop.shape[0]), numpy.sqrt(dop.shape[0])), order='F')
+    if dops.shape[2] == 1:
+        n = int(round(numpy.sqrt(dops.shape[1])))
+        # column stacking, the transpose of row stacking
+        dops = dops.reshape(len(dops), n, n).transpose(0, 2, 1)
 
     colors = []
-    num_colors = dop.shape[0]*(dop.shape[0] +1)/2
+    num_colors = dops.shape[1]*(dops.shape[1] +1)/2
     #print num_colors
     for n in range(0, num_colors):
         colors.append( (numpy.random.uniform(low=0., high=1.), 
                         numpy.random.uniform(low=0., high=1.), 
                         numpy.random.uniform(low=0., high=1.)) ) 
 
+    num_buckets = 0
+    if decimate:
+        num_buckets = _num_buckets(4)
+
     figure(figsize=(4, 4))                 
     axis([-2, 2, -2, 2])
     hold(True)
     grid(True)
-    for row in range(0, dop.shape[0]):
-        for col in range(0, dop.shape[1]):
-            if col >= row:
-                num_color = row*dop.shape[0] + col  - row*(row +1)/2
-            else:
-                continue            
-                num_color = col*dop.shape[1] + row  - col*(col +1)/2
-
-            print 'traj  [' + str(row) +', ' + str(col) + ']'
-            traj_re = []
-            traj_im = []
-            for i in range(0, len(signal)):
-                (time, dop) = signal[i]
-                if dop.shape[1] == 1:
-                    dop = numpy.reshape(dop, (numpy.sqrt(dop.shape[0]), numpy.sqrt(dop.shape[0])), order='F')
-                val = dop[row][col]
-                traj_re.append(numpy.real(val))
-                traj_im.append(numpy.imag(val))
-
-            plot(traj_re, traj_im)
+    (rows, cols) = numpy.triu_indices(dops.shape[1])
+    for (row, col) in zip(rows, cols):
+        traj = dops[:, row, col]
+        traj = traj[_complex_indices(traj, num_buckets)]
+        plot(numpy.real(traj), numpy.imag(traj))
 
     show()
 
 
-def bloch_vector(signal):
+def bloch_vector(signal, decimate=True):
+    """
+    plot the Bloch vector's trajectory of a qubit on the Bloch sphere
+        decimate   if True only plot the min/max samples of each
+                   coordinate for each pixel column of the figure
+    """
     assert len(signal)
     (time,dop) = signal[0]
     assert dop.shape[0] == dop.shape[1] == 2
 
-    import pauli 
-    import hs
-
-    x = []
-    y = []
-    z = []
-    for i in range(0,len(signal)):
-        (time,dop) = signal[i]
-        # coordinates in the basis I, X, Y e Z
-        i_tmp = hs.dot(pauli.I,dop)
-        x_tmp = hs.dot(pauli.X,dop)
-        y_tmp = hs.dot(pauli.Y,dop)
-        z_tmp = hs.dot(pauli.Z,dop)
-#        print i_tmp, x_tmp, y_tmp, z_tmp
-#        assert numpy.imag(x_tmp) == numpy.imag(y_tmp) == numpy.imag(z_tmp) == 0.
-#        print 'dop',  dop
-#        print 'sum',  (pauli.I*i_tmp + x_tmp*pauli.X+y_tmp*pauli.Y+z_tmp*pauli.Z)/2.
-#        assert (pauli.I*i_tmp + x_tmp*pauli.X+y_tmp*pauli.Y+z_tmp*pauli.Z == dop).all()
-        x.append(numpy.real(x_tmp))
-        y.append(numpy.real(y_tmp))
-        z.append(numpy.real(z_tmp))
-
-#    x = numpy.array(x)   
-#    y = numpy.array(y)   
-#    z = numpy.array(z)   
-
-#    print x
-#    print y
-#    print z
-#   print x.shape
-#   print y.shape
-#   print z.shape
+    import bloch
+    vector = bloch.vector(signal, check_hermitian=False)
+    if decimate:
+        vector = vector[_minmax_indices(vector.transpose(),
+                                        _num_buckets(rcParams['figure.figsize'][0]))]
+    x = vector[:,0]
+    y = vector[:,1]
+    z = vector[:,2]
 
     from mpl_toolkits.mplot3d import Axes3D
     import pylab
@@ -288,15 +413,19 @@ def bloch_vector(signal):
 
     pylab.show()
     
-def bloch_vector2(signal):
+def bloch_vector2(signal, decimate=True):
+    """
+    as bloch_vector()
+    """
     assert len(signal)
     (time,dop) = signal[0]
     assert dop.shape[0] == dop.shape[1] == 2
 
-    import pauli 
-    import hs
     import bloch
     vector = bloch.vector(signal)
+    if decimate:
+        vector = vector[_minmax_indices(vector.transpose(),
+                                        _num_buckets(rcParams['figure.figsize'][0]))]
 
     from mpl_toolkits.mplot3d import Axes3D
     import pylab
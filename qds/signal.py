@@ -19,60 +19,301 @@
 #    3. This notice may not be removed or altered from any source
 #    distribution.
 
-class Signal():
-    def __init__(self, name="unnamed signal"):
+import json
+import numpy
+
+class Signal(object):
+    """
+    a sequence of (time, value) samples where all the values are matrices,
+    or stacks of matrices, of the same shape; samples are kept in two
+    contiguous arrays which grow by doubling their capacity
+    """
+    def __init__(self, name="unnamed signal", capacity=16, dtype=complex):
+        assert capacity > 0
         self._name = name
-        self._timeline = []
-        self._values = []
-        self._values_rows = None
-        self._values_cols = None
-    
+        self._dtype = dtype
+        self._capacity = capacity
+        self._len = 0
+        self._timeline = None
+        self._values = None
+        self._value_shape = None
+
+    @classmethod
+    def from_arrays(cls, times, values, name="unnamed signal"):
+        """
+        wrap existing arrays of sample times and values, without copying them
+        """
+        assert values.ndim >= 3
+        assert len(times) == len(values)
+        signal = cls(name, max(len(times), 1), values.dtype)
+        if len(times):
+            signal._timeline = numpy.asarray(times, dtype=numpy.float64)
+            signal._values = values
+            signal._value_shape = values.shape[1:]
+            signal._len = len(times)
+        return signal
+
     def __getitem__(self, at):
-        return (self._timeline[at], self._values[at])
+        return (self.times[at], self.values[at])
 
     def __len__(self):
-        return len(self._timeline)
+        return self._len
+
+    @property
+    def times(self):
+        """
+        view of the sample times as a float64 array
+        """
+        if self._timeline is None:
+            return numpy.zeros(0)
+        return self._timeline[:self._len]
+
+    @property
+    def values(self):
+        """
+        view of the samples as a (len,) + shape() array
+        """
+        if self._values is None:
+            return numpy.zeros((0, 0, 0), dtype=self._dtype)
+        return self._values[:self._len]
 
     def shape(self):
-        assert len(self._timeline)
-        return self._values[0].shape
+        assert self._len
+        return self._value_shape
+
+    def _reserve(self, capacity):
+        """
+        grow the storage to hold at least capacity samples
+        """
+        if capacity <= self._values.shape[0]:
+            return
+        timeline = numpy.empty(capacity)
+        values = numpy.empty((capacity,) + self._values.shape[1:], dtype=self._dtype)
+        timeline[:self._len] = self._timeline[:self._len]
+        values[:self._len] = self._values[:self._len]
+        self._timeline = timeline
+        self._values = values
 
     def append(self, time, value):
-        # accept only 2D numpy arrays
-        assert value.ndim == 2
-        if not len(self._timeline):
-            self._values_rows = value.shape[0]
-            self._values_cols = value.shape[1]
+        # accept only numpy matrices or stacks of matrices
+        assert value.ndim >= 2
+        if not self._len:
+            self._value_shape = value.shape
+            self._timeline = numpy.empty(self._capacity)
+            self._values = numpy.empty((self._capacity,) + value.shape, dtype=self._dtype)
         else:
             # force all values to have the same shape
-            assert self._values_rows == value.shape[0] and \
-                   self._values_cols == value.shape[1]
+            assert self._value_shape == value.shape
+            if self._len == self._values.shape[0]:
+                self._reserve(2*self._len)
+
+        self._timeline[self._len] = time
+        self._values[self._len] = value
+        self._len = self._len + 1
 
-        self._timeline.append(time)
-        self._values.append(value)
+    def flush(self):
+        """
+        nothing to do for in-memory signals, see DiskSignal.flush()
+        """
+        pass
 
     def timeline(self):
-        return self._timeline
+        return self.times
 
-    def upper_triang_trajectories(self):
-        if not len(self._timeline):
+    def upper_triang_trajectories(self, elements=None):
+        """
+        trajectories of the elements in the upper triangular part of the
+        values, row by row, as a (n*(n+1)/2, len) array
+            elements   optional sequence of (row, col) pairs selecting the
+                       elements to return, in the given order
+        """
+        if not self._len:
             return []
 
-        assert self._values_rows == self._values_cols
+        assert len(self._value_shape) == 2
+        assert self._value_shape[0] == self._value_shape[1]
+
+        if elements is None:
+            (rows, cols) = numpy.triu_indices(self._value_shape[0])
+        else:
+            rows = [row for (row, col) in elements]
+            cols = [col for (row, col) in elements]
+        return self.values[:, rows, cols].transpose()
+
+
+class DiskSignal(Signal):
+    """
+    a Signal whose samples are spilled to disk in chunks while it grows;
+    reading is lazy and random-access through memory-mapped views.
+    Samples are kept in the raw files path + '.times' and path + '.values',
+    their shape and count in path + '.json'
+    """
+    def __init__(self, path, name="unnamed signal", chunk=4096, dtype=complex, mode='w'):
+        """
+        path     base file name of the signal's files
+        name     signal's name
+        chunk    number of samples buffered in memory before being written
+        dtype    values' data type
+        mode     'w' to create a new signal, 'a' to append to an existing
+                 one and 'r' to open an existing one read-only
+        """
+        assert chunk > 0
+        assert mode in ('w', 'a', 'r')
+        Signal.__init__(self, name, chunk, dtype)
+        self._path = path
+        self._mode = mode
+        self._flushed = 0
+        self._buffered = 0
+        self._map_len = 0
+        self._map_times = None
+        self._map_values = None
+
+        if mode == 'w':
+            open(self._times_file(), 'wb').close()
+            open(self._values_file(), 'wb').close()
+            self._write_header()
+        else:
+            f = open(path + '.json', 'r')
+            header = json.load(f)
+            f.close()
+            self._name = header['name']
+            self._dtype = numpy.dtype(str(header['dtype']))
+            if header['shape'] is not None:
+                self._value_shape = tuple(header['shape'])
+            self._flushed = self._len = header['len']
+
+    def _times_file(self):
+        return self._path + '.times'
+
+    def _values_file(self):
+        return self._path + '.values'
+
+    def _write_header(self):
+        header = {'name' : self._name,
+                  'dtype' : numpy.dtype(self._dtype).str,
+                  'shape' : self._value_shape,
+                  'len' : self._flushed}
+        f = open(self._path + '.json', 'w')
+        json.dump(header, f)
+        f.close()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def times(self):
+        self._map()
+        if self._map_times is None:
+            return numpy.zeros(0)
+        return self._map_times
+
+    @property
+    def values(self):
+        self._map()
+        if self._map_values is None:
+            return numpy.zeros((0, 0, 0), dtype=self._dtype)
+        return self._map_values
+
+    def _map(self):
+        """
+        flush the buffered samples and refresh the memory maps
+        """
+        self.flush()
+        if self._map_len == self._len or not self._len:
+            return
+        self._map_times = numpy.memmap(self._times_file(), dtype=numpy.float64,
+                                       mode='r', shape=(self._len,))
+        self._map_values = numpy.memmap(self._values_file(), dtype=self._dtype, mode='r',
+                                        shape=(self._len,) + self._value_shape)
+        self._map_len = self._len
+
+    def append(self, time, value):
+        assert self._mode != 'r'
+        # accept only numpy matrices or stacks of matrices
+        assert value.ndim >= 2
+        if not self._len:
+            self._value_shape = value.shape
+        else:
+            # force all values to have the same shape
+            assert self._value_shape == value.shape
+        if self._values is None:
+            self._timeline = numpy.empty(self._capacity)
+            self._values = numpy.empty((self._capacity,) + value.shape, dtype=self._dtype)
+
+        self._timeline[self._buffered] = time
+        self._values[self._buffered] = value
+        self._buffered = self._buffered + 1
+        self._len = self._len + 1
+        if self._buffered == self._capacity:
+            self.flush()
+
+    def extend(self, times, values):
+        """
+        append a block of samples, written straight to disk
+        """
+        assert self._mode != 'r'
+        assert len(times) == len(values)
+        if not len(times):
+            return
+        if not self._len:
+            self._value_shape = values.shape[1:]
+        else:
+            assert self._value_shape == values.shape[1:]
+
+        self.flush()
+        f = open(self._times_file(), 'ab')
+        numpy.asarray(times, dtype=numpy.float64).tofile(f)
+        f.close()
+        f = open(self._values_file(), 'ab')
+        numpy.asarray(values, dtype=self._dtype).tofile(f)
+        f.close()
+        self._flushed = self._flushed + len(times)
+        self._len = self._len + len(times)
+        self._write_header()
 
-        trajectories = []
-        n = self._values_rows
-        num_trajs = (n*(n+1))/2
-        for i in range(0,num_trajs):
-            trajectories.append([])
+    def truncate(self, length):
+        """
+        drop the samples past the first length ones
+        """
+        assert self._mode != 'r'
+        assert 0 <= length <= self._len
+        self.flush()
+        self._map_times = None
+        self._map_values = None
+        self._map_len = 0
 
-        for v in self._values:
-            i = 0
-            for row in range(0, n):
-                for col in range(row, n):
-                    trajectories[i].append(v[row][col])
-                    i = i+1
+        f = open(self._times_file(), 'r+b')
+        f.truncate(length*numpy.dtype(numpy.float64).itemsize)
+        f.close()
+        f = open(self._values_file(), 'r+b')
+        if self._value_shape is not None:
+            f.truncate(length*numpy.dtype(self._dtype).itemsize*int(numpy.prod(self._value_shape)))
+        f.close()
+        self._flushed = self._len = length
+        self._write_header()
 
-        return trajectories
-        
+    def flush(self):
+        """
+        write the buffered samples to disk
+        """
+        if not self._buffered:
+            return
+        f = open(self._times_file(), 'ab')
+        self._timeline[:self._buffered].tofile(f)
+        f.close()
+        f = open(self._values_file(), 'ab')
+        self._values[:self._buffered].tofile(f)
+        f.close()
+        self._flushed = self._flushed + self._buffered
+        self._buffered = 0
+        self._write_header()
 
+    def close(self):
+        """
+        flush the buffered samples and release the memory maps
+        """
+        self.flush()
+        self._map_times = None
+        self._map_values = None
+        self._map_len = 0
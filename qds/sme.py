@@ -0,0 +1,133 @@
+# Copyright (c) 2009 Riccardo Lucchese, riccardo.lucchese at gmail.com
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+
+import numpy
+import fme
+import lme
+
+from signal import Signal
+
+
+def _diffusion(dops, L, L_adj):
+    """
+    homodyne measurement superoperator H[L] applied to a (R, n, n) stack:
+    L*dop + dop*adj(L) - tr(L*dop + dop*adj(L))*dop; also returns the traces
+    """
+    G = numpy.matmul(L, dops) + numpy.matmul(dops, L_adj)
+    traces = numpy.trace(G, axis1=1, axis2=2)
+    return (G - traces[:,numpy.newaxis,numpy.newaxis]*dops, traces)
+
+
+def integrate(dop_0, H, M, F, tstep, tf, num_real=100, method='euler', seed=None,
+              save_every=1, keep_states=False, noise_chunk=1024):
+    """
+    integrate the stochastic master equation of homodyne detection with
+    Wiseman-Milburn Markovian feedback for many noise realizations at once
+    	d(dop) = lme(H_lme, L_lme)(dop)*dt + H[L_lme](dop)*dW
+    where (H_lme, L_lme) = fme.corresponding_lme_operators(H, M, F), so that
+    the ensemble average follows fme.integrate()
+    	dop_0	      system's initial state as a density operator
+	H	      system's Hamiltonian
+	M             measurement operator
+        F             feedback operator
+    	tstep	      simulation step time
+    	tf	      simulation finish time
+        num_real      number of noise realizations, stepped together
+        method        'euler' for Euler-Maruyama or 'milstein'
+        seed          seed of the random generator, for reproducible runs
+        save_every    only store the states every save_every steps
+        keep_states   if True also return the state of every realization
+        noise_chunk   number of steps whose Wiener increments are drawn
+                      at once
+
+    returns a tuple (mean, std, records, states): Signals of the ensemble
+    mean and elementwise standard deviation of the states, the (num_real, T)
+    array of the integrated measurement records Y(t) = int tr((M+adj(M))dop)dt
+    + dW at the saved times, and a Signal of (num_real, n, n) stacks of
+    states if keep_states, else None
+    """
+    # matrices checks are done in corresponding_lme_operators()
+    assert dop_0.ndim == 2 and dop_0.shape == H.shape
+    assert (dop_0 == dop_0.conj().transpose()).all()
+    assert numpy.abs(1. - numpy.trace(dop_0)) < 0.000000001
+
+    # check timing params
+    assert (tstep > 0) and (tf >= tstep)
+    assert num_real >= 1 and save_every >= 1 and noise_chunk >= 1
+    assert method in ('euler', 'milstein')
+
+    (H_lme, L_lme) = fme.corresponding_lme_operators(H, M, F)
+    L_adj = L_lme.conj().transpose()
+    M_herm = M + M.conj().transpose()
+    # realizations are kept row-wise for the drift, as a (R, n*n) matrix
+    drift_T = lme.liouvillian(H_lme, (L_lme,)).transpose()
+    n = dop_0.shape[0]
+
+    rng = numpy.random.RandomState(seed)
+    num_steps = lme._num_steps(tstep, tf)
+    num_saved = num_steps/save_every + 1
+    times = numpy.arange(0, num_steps + 1, save_every)*tstep
+
+    mean = numpy.empty((num_saved, n, n), dtype=complex)
+    std = numpy.empty((num_saved, n, n))
+    records = numpy.zeros((num_real, num_saved))
+    states = None
+    if keep_states:
+        states = Signal('Conditional density op. evolution', capacity=num_saved)
+
+    dops = numpy.tile(dop_0.astype(complex), (num_real, 1, 1))
+    Y = numpy.zeros(num_real)
+    mean[0] = dop_0
+    std[0] = 0.
+    if keep_states:
+        states.append(0., dops)
+
+    for step in range(1, num_steps + 1):
+        if not (step - 1) % noise_chunk:
+            noise = rng.normal(scale=numpy.sqrt(tstep),
+                               size=(min(noise_chunk, num_steps - step + 1), num_real))
+        dW = noise[(step - 1) % noise_chunk]
+
+        drift = numpy.dot(dops.reshape(num_real, -1), drift_T).reshape(dops.shape)
+        (diffusion, traces) = _diffusion(dops, L_lme, L_adj)
+        Y = Y + numpy.real(numpy.einsum('ij,rji->r', M_herm, dops))*tstep + dW
+
+        new_dops = dops + tstep*drift + dW[:,numpy.newaxis,numpy.newaxis]*diffusion
+        if method == 'milstein':
+            # derivative of H[L] along itself:
+            # G(b) - tr(G(b))*dop - tr(G(dop))*b with G(x) = L*x + x*adj(L)
+            (G_diff, G_traces) = _diffusion(diffusion, L_lme, L_adj)
+            correction = G_diff + (G_traces - traces)[:,numpy.newaxis,numpy.newaxis]*diffusion \
+                         - G_traces[:,numpy.newaxis,numpy.newaxis]*dops
+            new_dops = new_dops + 0.5*(dW*dW - tstep)[:,numpy.newaxis,numpy.newaxis]*correction
+        dops = new_dops
+
+        if not step % save_every:
+            saved = step/save_every
+            mean[saved] = dops.mean(axis=0)
+            std[saved] = dops.std(axis=0)
+            records[:,saved] = Y
+            if keep_states:
+                states.append(times[saved], dops)
+
+    return (Signal.from_arrays(times, mean, 'Density op. ensemble mean'),
+            Signal.from_arrays(times, std, 'Density op. ensemble std. deviation'),
+            records, states)
@@ -0,0 +1,168 @@
+# Copyright (c) 2009 Riccardo Lucchese, riccardo.lucchese at gmail.com
+#
+# This software is provided 'as-is', without any express or implied
+# warranty. In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+#    1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+#
+#    2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+#
+#    3. This notice may not be removed or altered from any source
+#    distribution.
+
+import os
+import pickle
+import itertools
+import multiprocessing
+import numpy
+import fme
+
+
+def grid(Ms, Fs):
+    """
+    all the (M, F) pairs of measurement and feedback operators
+    Ms     sequence of measurement operators
+    Fs     sequence of feedback operators
+    """
+    points = []
+    for M in Ms:
+        for F in Fs:
+            points.append((M, F))
+    return points
+
+
+def convergence_time(signal, tol):
+    """
+    time after which the state stays within tol of the final one, in the
+    max-abs-element sense
+    signal     a Signal as returned by lme.integrate()
+    tol        tolerance on the elements of the state
+    """
+    assert len(signal)
+    values = signal.values
+    dev = numpy.abs(values - values[-1]).reshape(len(values), -1).max(axis=1)
+    outside = numpy.nonzero(dev > tol)[0]
+    if not len(outside):
+        return signal.times[0]
+    return signal.times[min(outside[-1] + 1, len(values) - 1)]
+
+
+def _run_point(task):
+    """
+    integrate the FME for one point of the sweep; runs in the worker
+    processes
+    """
+    (index, dop_0, H, M, F, tstep, tf, integrator, summary, conv_tol) = task
+    # a metrics dict keeps the workers from printing
+    metrics = {}
+    evo = fme.integrate(dop_0, H, M, F, tstep, tf, integrator, metrics=metrics)
+    if not summary:
+        return (index, evo)
+    return (index, {'final' : evo.values[-1].copy(),
+                    'convergence_time' : convergence_time(evo, conv_tol),
+                    'max_delta_dop' : metrics['max_delta_dop']})
+
+
+def _load_journal(journal):
+    """
+    results stored by a previous, possibly interrupted, sweep and the
+    offset in the journal right after the last complete record
+    """
+    results = []
+    offset = 0
+    try:
+        f = open(journal, 'rb')
+    except IOError:
+        return (results, offset)
+    while True:
+        try:
+            results.append(pickle.load(f))
+        except Exception:
+            # end of the journal or a damaged, ie. cut short, last record;
+            # the unpickler raises about anything on garbage
+            break
+        offset = f.tell()
+    f.close()
+    return (results, offset)
+
+
+def fme_sweep(dop_0, H, points, tstep, tf, integrator='euler', processes=None,
+              chunksize=1, summary=False, conv_tol=1e-6, journal=None):
+    """
+    integrate the Wiseman-Milburn FME over a set of (M, F) operators,
+    spreading the runs over a pool of processes; this is a generator
+    yielding (index, result) tuples as the runs finish, where index is the
+    position of the point in points
+    	dop_0	      system's initial state as a density operator
+	H	      system's Hamiltonian
+        points        sequence of (M, F) measurement and feedback
+                      operators, see grid()
+    	tstep	      simulation step time
+    	tf	      simulation finish time
+        integrator    see fme.integrate()
+        processes     number of worker processes, defaults to the number
+                      of cpus; with 1 the runs are done in this process,
+                      one at a time
+        chunksize     number of points handed to a worker at a time
+        summary       if True results are dicts with the 'final' state, its
+                      'convergence_time' and the run's 'max_delta_dop'
+                      instead of full Signals
+        conv_tol      tolerance used for the convergence time
+        journal       file where finished results are appended; points
+                      already found there are yielded first and not run
+                      again, so an interrupted sweep can be resumed
+    """
+    done = set()
+    offset = 0
+    if journal:
+        (results, offset) = _load_journal(journal)
+        for (index, result) in results:
+            done.add(index)
+            yield (index, result)
+
+    tasks = []
+    for index in range(0, len(points)):
+        if index in done:
+            continue
+        (M, F) = points[index]
+        tasks.append((index, dop_0, H, M, F, tstep, tf, integrator, summary, conv_tol))
+    if not tasks:
+        return
+
+    pool = None
+    if processes == 1:
+        results = itertools.imap(_run_point, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_run_point, tasks, chunksize)
+
+    f = None
+    if journal:
+        if os.path.exists(journal):
+            # drop whatever follows the last complete record
+            f = open(journal, 'r+b')
+            f.seek(offset)
+            f.truncate()
+        else:
+            f = open(journal, 'wb')
+    try:
+        for (index, result) in results:
+            if f:
+                pickle.dump((index, result), f, 2)
+                f.flush()
+            yield (index, result)
+    finally:
+        if f:
+            f.close()
+        if pool:
+            pool.terminate()
+            pool.join()
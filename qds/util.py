@@ -66,23 +66,60 @@ def hermitian_subspace_basis(n):
     return basis            
 
 
-def hermitian_subspace_generator(generator_func, n):
+_basis_tensors = {}
+
+def hermitian_subspace_basis_tensor(n):
+    """
+    the basis returned by hermitian_subspace_basis(n) stacked in a read-only
+    (n*n, n, n) array; cached across calls
+    """
+    if n not in _basis_tensors:
+        tensor = numpy.array(hermitian_subspace_basis(n))
+        tensor.setflags(write=False)
+        _basis_tensors[n] = tensor
+    return _basis_tensors[n]
+
+
+def _hermitian_subspace_map(basis, images):
+    """
+    the matrix of inner products hs.dot(basis[col], images[row])
+    """
+    return numpy.real(hs.dots(basis, images).transpose())
+
+
+def hermitian_subspace_generator(generator_func, n, batched=False):
     """
     return the generator acting on the real Hermitian subspace of n*n complex matrices
 	generator_func  function accepting a n*n matrix and returning the
 	                time derivative for the given input
 	n               system's order
+        batched         if True generator_func accepts a (k, n, n) stack
+                        of matrices and returns the stack of their time
+                        derivatives, and is called only once
     """
     assert generator_func
     assert n>0
 
-    basis = hermitian_subspace_basis(n)
-    _map = numpy.zeros((n*n,n*n))
-    row = 0
-    col = 0
-    for row in range(0, n*n):
-        for col in range(0, n*n):
-            _map[row][col] = hs.dot(basis[col], generator_func(basis[row]))
+    basis = hermitian_subspace_basis_tensor(n)
+    if batched:
+        images = generator_func(basis)
+    else:
+        images = numpy.array([generator_func(B) for B in basis])
+
+    return _hermitian_subspace_map(basis, images)
+
+
+def hermitian_subspace_superop(superop, n):
+    """
+    return the generator acting on the real Hermitian subspace of n*n
+    complex matrices, given it as a n^2*n^2 superoperator acting on the
+    row-stacked matrices (ie. lme.liouvillian())
+	superop         the superoperator
+	n               system's order
+    """
+    assert superop.shape == (n*n, n*n)
 
-    return _map
+    basis = hermitian_subspace_basis_tensor(n)
+    images = numpy.dot(basis.reshape(n*n, -1), superop.transpose()).reshape(basis.shape)
+    return _hermitian_subspace_map(basis, images)
 